@@ -0,0 +1,118 @@
+"""
+Cross-run drift detection for /query/anomalies.
+
+step_stats keeps a running count / mean / M2 (Welford) per (pipeline,
+step_name, metric), updated with every newly ingested step. Before a
+step's value is folded in, it is compared with the statistics of the
+steps before it; a value more than ANOMALY_Z standard deviations from
+the mean is recorded in step_anomalies. Queries read those two tables
+and never rescan steps.
+"""
+import math
+import os
+
+ANOMALY_Z = float(os.environ.get("XRAY_ANOMALY_Z", 3.0))
+# steps of the same (pipeline, step_name) seen before anything is flagged
+ANOMALY_MIN_BASELINE = int(os.environ.get("XRAY_ANOMALY_MIN_BASELINE", 30))
+
+# failure is 1 for a step with a failure_mode, else 0: its mean is the failure rate
+METRICS = {
+    "filtered_ratio": "s.filtered_ratio",
+    "approved_count": "s.approved_count",
+    "latency_ms": "s.latency_ms",
+    "failure": "CAST(s.failure_mode IS NOT NULL AS REAL)",
+}
+
+_METRIC_ROWS = " UNION ALL ".join(f"SELECT '{m}' AS metric" for m in METRICS)
+_METRIC_VALUE = "CASE m.metric " + " ".join(
+    f"WHEN '{m}' THEN {expr}" for m, expr in METRICS.items()
+) + " END"
+
+# pipeline_name: what the SDK sent, else the run's (as for latency_histograms)
+STEP_VALUES_SQL = f"""
+    SELECT * FROM (
+        SELECT s.step_id, s.run_id, s.step_name, s.created_at,
+               coalesce(nullif(?1, ''), r.pipeline_name, '') AS pipeline_name,
+               m.metric, {_METRIC_VALUE} AS value
+        FROM steps s
+        LEFT JOIN runs r ON r.run_id = s.run_id
+        CROSS JOIN ({_METRIC_ROWS}) m
+        WHERE s.step_id = ?2 AND s.step_name IS NOT NULL
+    )
+    WHERE value IS NOT NULL
+"""
+
+STATS_UPSERT_SQL = """
+    INSERT OR REPLACE INTO step_stats (pipeline_name, step_name, metric, n, mean, m2)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+ANOMALY_INSERT_SQL = """
+    INSERT OR REPLACE INTO step_anomalies
+    (step_id, metric, run_id, pipeline_name, step_name, created_at, value, mean, stddev, z)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# two passes: each value's deviation from its group mean, then M2 as their sum of squares
+BACKFILL_SQL = f"""
+    WITH v AS (
+        SELECT coalesce(r.pipeline_name, '') AS pipeline_name, s.step_name,
+               m.metric, {_METRIC_VALUE} AS value
+        FROM steps s
+        LEFT JOIN runs r ON r.run_id = s.run_id
+        CROSS JOIN ({_METRIC_ROWS}) m
+        WHERE s.step_name IS NOT NULL
+    ),
+    d AS (
+        SELECT *, value - AVG(value) OVER (PARTITION BY pipeline_name, step_name, metric) AS dev
+        FROM v WHERE value IS NOT NULL
+    )
+    INSERT INTO step_stats (pipeline_name, step_name, metric, n, mean, m2)
+    SELECT pipeline_name, step_name, metric, COUNT(*), AVG(value), SUM(dev * dev)
+    FROM d GROUP BY 1, 2, 3
+"""
+
+
+def backfill(conn):
+    """Seed step_stats from the steps already stored; past steps are not flagged."""
+    conn.execute(BACKFILL_SQL)
+
+
+def stddev(n, m2):
+    return math.sqrt(m2 / (n - 1)) if n > 1 else 0.0
+
+
+def record_step_stats(cur, steps, threshold=ANOMALY_Z, min_baseline=ANOMALY_MIN_BASELINE):
+    """Score `steps` (new, already written) against their running stats, then fold them in."""
+    stats = {}
+    anomalies = []
+    for step in steps:
+        for row in cur.execute(STEP_VALUES_SQL, (step.pipeline_name, step.step_id)).fetchall():
+            key = (row["pipeline_name"], row["step_name"], row["metric"])
+            if key not in stats:
+                found = cur.execute(
+                    "SELECT n, mean, m2 FROM step_stats"
+                    " WHERE pipeline_name = ? AND step_name = ? AND metric = ?",
+                    key,
+                ).fetchone()
+                stats[key] = tuple(found) if found else (0, 0.0, 0.0)
+            n, mean, m2 = stats[key]
+            value = row["value"]
+
+            sd = stddev(n, m2)
+            # a metric that has never varied has no scale to measure drift against
+            if n >= min_baseline and sd > 0:
+                z = (value - mean) / sd
+                if abs(z) >= threshold:
+                    anomalies.append(
+                        (row["step_id"], row["metric"], row["run_id"], row["pipeline_name"],
+                         row["step_name"], row["created_at"], value, mean, sd, z)
+                    )
+
+            n += 1
+            delta = value - mean
+            mean += delta / n
+            stats[key] = (n, mean, m2 + delta * (value - mean))
+
+    cur.executemany(STATS_UPSERT_SQL, [(*key, *s) for key, s in stats.items()])
+    cur.executemany(ANOMALY_INSERT_SQL, anomalies)
@@ -1,195 +1,822 @@
-from fastapi import FastAPI
-from datetime import datetime
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from pydantic import ValidationError
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Literal
+import asyncio
+import functools
 import json
+import logging
+import queue
 
-from .db import get_conn, init_db
-from .models import RunIngestRequest, StepIngestRequest
+from . import cold
+from .anomalies import stddev
+from .cache import ResultCache, pipeline_scopes, write_scopes
+from .codec import MAX_BODY_BYTES, MAX_UPLOAD_BYTES, BodyDecoder, CodecRoute
+from .db import Database
+from .diff import DEFAULT_SAMPLE_IDS, diff_runs
+from .latency import percentiles
+from .ingest import (
+    chunk_by_days,
+    delete_samples,
+    sample_days,
+    sample_row,
+    step_day,
+    write_records,
+    write_samples,
+)
+from .models import BatchIngestRequest, RunIngestRequest, StepIngestRequest
+from .pagination import MAX_PAGE_SIZE, paginate
+from .partitions import MAX_ATTACHED
+from .runs import etag, run_document
+from .search import search_samples, search_steps
 
-app = FastAPI(title="X-Ray Backend")
+db = Database()
+query_cache = ResultCache()
+logger = logging.getLogger(__name__)
 
-init_db()
 
-@app.post("/ingest/run")
-def ingest_run(payload: RunIngestRequest):
-    conn = get_conn()
-    cur = conn.cursor()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db.open()
+    yield
+    db.close()
 
-    cur.execute(
-        """
-        INSERT INTO runs (
-            run_id, pipeline_name, input_summary,
-            outcome_summary, started_at, ended_at, metadata_json
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(run_id) DO UPDATE SET
-            outcome_summary = excluded.outcome_summary,
-            ended_at       = excluded.ended_at
-    """,
-        (
-            payload.run_id,
-            payload.pipeline_name,
-            json.dumps(payload.input_summary or {}),
-            json.dumps(payload.outcome_summary or {}),
-            payload.started_at,
-            payload.ended_at,
-            json.dumps(payload.metadata or {}),
-        ),
-    )
 
-    conn.commit()
-    conn.close()
-    return {"status": "ok"}
+app = FastAPI(title="X-Ray Backend", lifespan=lifespan)
+# ingest bodies may be msgpack and/or gzip/zstd compressed (see codec.py)
+app.router.route_class = CodecRoute
 
 
-@app.post("/ingest/step")
-def ingest_step(payload: StepIngestRequest):
-    conn = get_conn()
-    cur = conn.cursor()
+async def read(fn):
+    """Run `fn(conn)` on the database's read executor."""
+    return await asyncio.wrap_future(db.read(fn))
 
-    cur.execute(
-        """
-        INSERT OR REPLACE INTO steps
-        (step_id, run_id, step_name, step_type,
-         input_summary, output_summary,
-         metrics_json, reasoning, context_json, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        (
-            payload.step_id,
-            payload.run_id,
-            payload.step_name,
-            payload.step_type,
-            json.dumps(payload.input_summary or {}),
-            json.dumps(payload.output_summary or {}),
-            json.dumps(payload.metrics or {}),
-            payload.reasoning,
-            json.dumps(payload.context or {}),
-            payload.created_at,
-        ),
+
+async def read_cold(fn):
+    """Run `fn(store)` against the cold tier (cold.py) in a worker thread."""
+    if not db.cold.available:
+        raise HTTPException(status_code=501, detail="the cold tier needs pyarrow installed")
+    return await asyncio.to_thread(fn, db.cold)
+
+
+# hot = the live SQLite database, cold = days exported to Parquet
+Tier = Literal["hot", "cold"]
+
+
+def cached(scopes):
+    """
+    Serve a /query endpoint from the result cache (cache.py), keyed on its
+    parameters. `scopes(params)` names the write scopes the result depends
+    on. Streams (format=ndjson) and the cold tier always go to the source.
+    """
+
+    def decorate(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(**params):
+            if params.get("format") == "ndjson" or params.get("tier") == "cold":
+                return await endpoint(**params)
+            key = (endpoint.__name__,) + tuple(
+                (k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(params.items())
+            )
+            return await query_cache.get_or_compute(
+                key, scopes(params), lambda: endpoint(**params)
+            )
+
+        return wrapper
+
+    return decorate
+
+
+def queue_write(fn, partitions=()):
+    """
+    db.write for request handlers, which must not block the event loop: a
+    full writer queue is answered with 503, which the SDK retries and
+    buffers like an unreachable backend.
+    """
+    try:
+        return db.write(fn, partitions, block=False)
+    except queue.Full:
+        raise HTTPException(
+            status_code=503, detail="too many pending writes", headers={"Retry-After": "1"}
+        ) from None
+
+
+async def submit(fn, sync, partitions=(), scopes=()):
+    fut = queue_write(fn, partitions)
+    # bumped once committed, so a read racing the write can't cache the old result
+    fut.add_done_callback(lambda _: query_cache.bump(scopes))
+    return await acknowledge(fut, sync)
+
+
+async def acknowledge(fut, sync):
+    """
+    Ingest is acknowledged once its write is queued for the writer thread;
+    sync=True waits for it to be committed instead.
+    """
+    if sync:
+        await asyncio.wrap_future(fut)
+        return "ok"
+    fut.add_done_callback(_report_write_error)
+    return "queued"
+
+
+def _report_write_error(fut):
+    if fut.exception() is not None:
+        logger.error("queued ingest write failed", exc_info=fut.exception())
+
+
+@app.post("/ingest/run")
+async def ingest_run(payload: RunIngestRequest, sync: bool = False):
+    status = await submit(
+        lambda cur: write_records(cur, runs=[payload]), sync, scopes=write_scopes(runs=[payload])
     )
+    return {"status": status}
 
-    # insert candidate samples if present
-    if payload.samples:
-        for s in payload.samples:
-            cur.execute(
-                """
-            INSERT INTO candidate_samples
-            (step_id, candidate_id, attributes_json, decision, score, rejection_reason)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """,
-                (
-                    payload.step_id,
-                    s.get("candidate_id"),
-                    json.dumps(s.get("attributes", {})),
-                    s.get("decision"),
-                    s.get("score"),
-                    s.get("rejection_reason"),
-                ),
+
+@app.post("/ingest/step")
+async def ingest_step(payload: StepIngestRequest, sync: bool = False):
+    status = await submit(
+        lambda cur: write_records(cur, steps=[payload]),
+        sync,
+        sample_days([payload]),
+        write_scopes(steps=[payload]),
+    )
+    return {"status": status}
+
+
+@app.post("/ingest/batch")
+async def ingest_batch(payload: BatchIngestRequest, sync: bool = False):
+    """
+    Ingest many run/step records in one request and one transaction.
+    Run records are upserts, so end_run updates can ride in the same batch
+    as their start_run. Returns a status per item, in request order.
+    """
+    runs, steps = [], []
+    results = []
+
+    for i, item in enumerate(payload.items):
+        model = RunIngestRequest if item.type == "run" else StepIngestRequest
+        try:
+            record = model.model_validate(item.payload)
+        except ValidationError as e:
+            results.append(
+                {
+                    "index": i,
+                    "status": "error",
+                    "errors": e.errors(
+                        include_url=False, include_context=False, include_input=False
+                    ),
+                }
             )
+            continue
 
-    conn.commit()
-    conn.close()
-    return {"status": "ok"}
+        (runs if item.type == "run" else steps).append(record)
+        results.append({"index": i, "status": "ok"})
+
+    # one write job unless the samples span more day partitions than can be attached;
+    # the runs go with the first
+    pending_runs = runs
+    for chunk, days in chunk_by_days(steps):
+        status = await submit(
+            lambda cur, r=pending_runs, c=chunk: write_records(cur, r, c),
+            sync,
+            days,
+            write_scopes(pending_runs, chunk),
+        )
+        pending_runs = []
+    return {"status": status, "accepted": len(runs) + len(steps), "results": results}
 
 
-@app.get("/query/run/{run_id}")
-def get_run(run_id: str):
-    conn = get_conn()
-    cur = conn.cursor()
+SAMPLE_UPLOAD_BATCH = 1000
 
-    run = cur.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
 
-    steps = cur.execute(
-        "SELECT * FROM steps WHERE run_id = ? ORDER BY created_at", (run_id,)
-    ).fetchall()
+def parse_sample(step_id, line):
+    try:
+        sample = json.loads(line)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid NDJSON line") from None
+    if not isinstance(sample, dict):
+        raise HTTPException(status_code=400, detail="each NDJSON line must be a JSON object")
+    return sample_row(step_id, sample)
 
-    result = {
-        "run": dict(run) if run else None,
-        "steps": [dict(s) for s in steps],
-    }
 
-    conn.close()
-    return result
+@app.post("/ingest/samples/{step_id}")
+async def ingest_samples(step_id: str, request: Request, sync: bool = False):
+    """
+    Full-capture candidate upload: a (optionally gzip/zstd-encoded) NDJSON body,
+    one sample per line, streamed in and inserted in batches so large
+    steps are never materialized in memory. An upload replaces the samples
+    stored for the step, so a retried or replayed upload is not counted twice.
+    """
+    decoder = BodyDecoder(request.headers.get("content-encoding"), MAX_UPLOAD_BYTES)
+
+    inserted = 0
+    pending = b""
+    rows = []
+    in_flight = None
+    # queued behind the step's own write, so the step is always found
+    day = await asyncio.wrap_future(queue_write(lambda cur: step_day(cur, step_id)))
+
+    async def flush(rows):
+        # one chunk in flight: the next is parsed while the writer inserts this one
+        nonlocal in_flight
+
+        def write(cur, first=in_flight is None):
+            if first:
+                delete_samples(cur, [step_id], day)
+            write_samples(cur, rows, day)
+
+        if in_flight is not None:
+            await asyncio.wrap_future(in_flight)
+        in_flight = queue_write(write, [day])
+
+    async for chunk in request.stream():
+        for piece in decoder.decompress(chunk):
+            pending += piece
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    rows.append(parse_sample(step_id, line))
+            if len(pending) > MAX_BODY_BYTES:
+                raise HTTPException(status_code=413, detail="NDJSON line too long")
+            if len(rows) >= SAMPLE_UPLOAD_BATCH:
+                await flush(rows)
+                inserted += len(rows)
+                rows = []
+
+    pending += decoder.flush()
+    if pending.strip():
+        rows.append(parse_sample(step_id, pending))
+    if rows:
+        await flush(rows)
+        inserted += len(rows)
+
+    status = await acknowledge(in_flight, sync) if in_flight else "ok"
+    return {"status": status, "inserted": inserted}
+
+
+# a run that ended a while ago no longer changes, so proxies may serve it this
+# long and revalidate with If-None-Match afterwards. Just after end_run its
+# last steps may still be committing (ingest acknowledges before commit), and
+# full-capture samples are uploaded after it: those documents, and any with
+# include=samples, are always revalidated.
+FINISHED_RUN_MAX_AGE = 300
+FINISHED_RUN_GRACE_S = 60
+
+
+def settled(ended_at):
+    """Whether a run ended more than FINISHED_RUN_GRACE_S ago (SDK times are naive UTC)."""
+    try:
+        ended = datetime.fromisoformat(ended_at)
+    except (TypeError, ValueError):
+        return False
+    if ended.tzinfo is None:
+        ended = ended.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - ended).total_seconds() > FINISHED_RUN_GRACE_S
 
 
-@app.get("/query/filter-events")
-def filter_events(ratio_gt: float = 0.83):
+@app.get("/query/run/{run_id}")
+async def get_run(
+    run_id: str,
+    request: Request,
+    include: list[Literal["samples"]] = Query([]),
+    samples_limit: int | None = Query(None, ge=1),
+    tier: Tier = "hot",
+):
     """
-    Example query: all filter steps where filtered_ratio > threshold
+    The run and its steps in created_at order, with JSON columns decoded.
+    include=samples adds each step's candidate samples (the first
+    `samples_limit` per step). Answers 304 when If-None-Match matches.
     """
-    conn = get_conn()
-    cur = conn.cursor()
+    if tier == "cold":
+        body, ended_at = await read_cold(
+            lambda store: store.run(run_id, "samples" in include, samples_limit)
+        )
+    else:
+        body, ended_at = await read(
+            lambda conn: run_document(
+                conn, db.partitions, run_id, "samples" in include, samples_limit
+            )
+        )
 
-    rows = cur.execute(
-        """
-        SELECT * FROM steps
-        WHERE step_type = 'filter'
+    tag = etag(body)
+    fresh = "samples" not in include and settled(ended_at)
+    headers = {
+        "ETag": tag,
+        "Cache-Control": f"public, max-age={FINISHED_RUN_MAX_AGE}" if fresh else "no-cache",
+    }
+    if tag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@app.get("/query/runs")
+@cached(lambda p: pipeline_scopes(p["pipeline"]) if p["pipeline"] else ("runs", "steps"))
+async def list_runs(
+    pipeline: str | None = None,
+    status: Literal["running", "completed", "failed"] | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    limit: int | None = Query(None, ge=1),
+    after: str | None = None,
+    format: Literal["json", "ndjson"] = "json",
+    tier: Tier = "hot",
+):
+    """
+    Runs newest first from the run_summaries rollup (step count, latency,
+    first failure_mode, status, duration), filtered by pipeline, status
+    and a started_at range.
     """
-    ).fetchall()
+    if tier == "cold":
+        page = await read_cold(
+            lambda store: store.paginate(
+                "runs",
+                cold.runs(pipeline, status, since, until),
+                after=after,
+                limit=limit,
+                format=format,
+                key=("started_at", "run_id"),
+                descending=True,
+            )
+        )
+        if format == "ndjson":
+            return page
+        results, next_cursor = page
+        return {"results": results, "next_cursor": next_cursor}
+
+    conditions, params = [], []
+    if pipeline:
+        conditions.append("pipeline_name = ?")
+        params.append(pipeline)
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if since:
+        conditions.append("started_at >= ?")
+        params.append(since)
+    if until:
+        conditions.append("started_at < ?")
+        params.append(until)
+
+    page = await paginate(
+        db,
+        "SELECT * FROM run_summaries",
+        conditions,
+        params,
+        after=after,
+        limit=limit,
+        format=format,
+        key=("started_at", "run_id"),
+        descending=True,
+    )
+    if format == "ndjson":
+        return page
 
-    matches = []
-    for r in rows:
-        metrics = json.loads(r["metrics_json"] or "{}")
-        if metrics.get("filtered_ratio", 0) > ratio_gt:
-            matches.append(dict(r))
+    results, next_cursor = page
+    return {"results": results, "next_cursor": next_cursor}
 
-    conn.close()
-    return {"results": matches}
+
+@app.get("/query/filter-events")
+@cached(lambda p: ("step_type:filter",))
+async def filter_events(
+    ratio_gt: float = 0.83,
+    limit: int | None = Query(None, ge=1),
+    after: str | None = None,
+    format: Literal["json", "ndjson"] = "json",
+    tier: Tier = "hot",
+):
+    """
+    Example query: all filter steps where filtered_ratio > threshold.
+    Paginated by `after` cursor; format=ndjson streams every match.
+    """
+    # a threshold below 0 asks for every filter step, with a ratio or not
+    missing = "OR filtered_ratio IS NULL" if ratio_gt < 0 else ""
+
+    if tier == "cold":
+        page = await read_cold(
+            lambda store: store.paginate(
+                "steps", cold.filter_events(ratio_gt), after=after, limit=limit, format=format
+            )
+        )
+    else:
+        page = await paginate(
+            db,
+            "SELECT * FROM steps",
+            ["step_type = 'filter'", f"(filtered_ratio > ? {missing})"],
+            [ratio_gt],
+            after=after,
+            limit=limit,
+            format=format,
+        )
+    if format == "ndjson":
+        return page
+
+    results, next_cursor = page
+    return {"results": results, "next_cursor": next_cursor}
 
 
 @app.get("/query/failures")
-def query_failures(mode: str | None = None):
+@cached(lambda p: ("runs", "steps"))
+async def query_failures(
+    mode: str | None = None,
+    limit: int | None = Query(None, ge=1),
+    after: str | None = None,
+    format: Literal["json", "ndjson"] = "json",
+    tier: Tier = "hot",
+):
     """
     Returns all runs where a step recorded a failure_mode.
     Optionally filter by specific failure mode.
     Works across pipelines and step names.
+    `results` is one page (`limit`, default 100); `count` is the number of
+    failures across all pages.
     """
-
-    conn = get_conn()
-    cur = conn.cursor()
-
-    rows = cur.execute(
+    if tier == "cold":
+        page = await read_cold(
+            lambda store: store.paginate(
+                "steps",
+                cold.failures(mode),
+                after=after,
+                limit=limit,
+                format=format,
+                columns=cold.FAILURE_COLUMNS,
+            )
+        )
+        if format == "ndjson":
+            return page
+        results, next_cursor = page
+        if after or next_cursor:
+            count = await read_cold(lambda store: store.count("steps", cold.failures(mode)))
+        else:
+            count = len(results)
+        return {"count": count, "results": results, "next_cursor": next_cursor}
+
+    conditions = ["steps.failure_mode = ?"] if mode else ["steps.failure_mode IS NOT NULL"]
+    params = [mode] if mode else []
+    page = await paginate(
+        db,
         """
         SELECT 
+            steps.step_id,
             steps.run_id,
             steps.step_name,
             steps.step_type,
             steps.created_at,
             runs.pipeline_name,
             runs.started_at,
-            json_extract(steps.context_json, '$.failure_mode') AS failure_mode
+            steps.failure_mode
         FROM steps
         JOIN runs ON steps.run_id = runs.run_id
-        WHERE failure_mode IS NOT NULL
+        """,
+        conditions,
+        params,
+        after=after,
+        limit=limit,
+        format=format,
+    )
+    if format == "ndjson":
+        return page
+
+    results, next_cursor = page
+    if after or next_cursor:
+        # only a single complete page can be counted from its rows
+        count = await read(
+            lambda conn: conn.execute(
+                "SELECT COUNT(*) FROM steps JOIN runs ON steps.run_id = runs.run_id"
+                f" WHERE {conditions[0]}",
+                params,
+            ).fetchone()[0]
+        )
+    else:
+        count = len(results)
+    return {"count": count, "results": results, "next_cursor": next_cursor}
+
+
+FAILURE_DIMENSIONS = {
+    "failure_mode": "steps.failure_mode",
+    "pipeline_name": "runs.pipeline_name",
+    "step_name": "steps.step_name",
+    "step_type": "steps.step_type",
+}
+
+# created_at is ISO-8601, so a prefix of it is a time bucket
+TIME_BUCKETS = {"minute": 16, "hour": 13, "day": 10}
+
+
+@app.get("/query/failures/summary")
+@cached(lambda p: ("runs", "steps"))
+async def failures_summary(
+    group_by: list[Literal["failure_mode", "pipeline_name", "step_name", "step_type"]] = Query(
+        ["failure_mode"]
+    ),
+    bucket: Literal["minute", "hour", "day"] | None = None,
+    mode: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    tier: Tier = "hot",
+):
+    """
+    Failure counts grouped by any of failure_mode / pipeline_name /
+    step_name / step_type and optionally a created_at time bucket,
+    aggregated in SQLite.
+    """
+    if tier == "cold":
+        groups = await read_cold(
+            lambda store: store.failure_counts(
+                group_by, TIME_BUCKETS[bucket] if bucket else None, mode, since, until
+            )
+        )
+        return {"total": sum(g["count"] for g in groups), "groups": groups}
+
+    columns = [f"{FAILURE_DIMENSIONS[d]} AS {d}" for d in dict.fromkeys(group_by)]
+    if bucket:
+        columns.append(f"substr(steps.created_at, 1, {TIME_BUCKETS[bucket]}) AS bucket")
+
+    conditions = ["steps.failure_mode = ?" if mode else "steps.failure_mode IS NOT NULL"]
+    params = [mode] if mode else []
+    if since:
+        conditions.append("steps.created_at >= ?")
+        params.append(since)
+    if until:
+        conditions.append("steps.created_at < ?")
+        params.append(until)
+
+    keys = ", ".join(str(i + 1) for i in range(len(columns)))
+    sql = f"""
+        SELECT {", ".join(columns)}, COUNT(*) AS count
+        FROM steps
+        JOIN runs ON steps.run_id = runs.run_id
+        WHERE {" AND ".join(conditions)}
+        GROUP BY {keys}
+        ORDER BY count DESC
     """
-    ).fetchall()
+    rows = await read(lambda conn: conn.execute(sql, params).fetchall())
 
-    results = []
-    for r in rows:
-        if mode and r["failure_mode"] != mode:
-            continue
-        results.append(dict(r))
+    groups = [dict(r) for r in rows]
+    return {"total": sum(g["count"] for g in groups), "groups": groups}
+
+
+@app.get("/query/weak-filters")
+@cached(lambda p: ("step_type:filter",))
+async def weak_filters(
+    ratio_lt: float = 0.2,
+    limit: int | None = Query(None, ge=1),
+    after: str | None = None,
+    format: Literal["json", "ndjson"] = "json",
+    tier: Tier = "hot",
+):
+    # steps without a filtered_ratio count as ratio 1 (nothing filtered out)
+    missing = "OR filtered_ratio IS NULL" if ratio_lt > 1 else ""
+
+    if tier == "cold":
+        page = await read_cold(
+            lambda store: store.paginate(
+                "steps", cold.weak_filters(ratio_lt), after=after, limit=limit, format=format
+            )
+        )
+    else:
+        page = await paginate(
+            db,
+            "SELECT * FROM steps",
+            ["step_type = 'filter'", f"(filtered_ratio < ? {missing})"],
+            [ratio_lt],
+            after=after,
+            limit=limit,
+            format=format,
+        )
+    if format == "ndjson":
+        return page
+
+    results, next_cursor = page
+    return {"results": results, "next_cursor": next_cursor}
+
+
+@app.get("/query/search")
+async def search(
+    q: str = Query(..., min_length=1),
+    scope: Literal["steps", "samples"] = "steps",
+    since: str | None = None,
+    until: str | None = None,
+    limit: int | None = Query(None, ge=1),
+    after: str | None = None,
+):
+    """
+    Ranked full-text search (FTS5 query syntax) over step reasoning and
+    output_summary (scope=steps) or candidate ids and attributes
+    (scope=samples). Sample search covers the day partitions in
+    [since, until), at most MAX_ATTACHED days per request; the most
+    recent ones when `since` is omitted.
+    """
+    if scope == "steps":
+        results, next_cursor = await read(lambda conn: search_steps(conn, q, after, limit))
+        return {"results": results, "next_cursor": next_cursor}
+
+    days = [
+        d
+        for d in db.partitions.days()
+        if (not since or d >= since[:10]) and (not until or d < until)
+    ]
+    if len(days) > MAX_ATTACHED:
+        if since:
+            raise HTTPException(
+                status_code=400,
+                detail=f"sample search spans at most {MAX_ATTACHED} days, got {len(days)}",
+            )
+        days = days[-MAX_ATTACHED:]
 
-    conn.close()
+    def query(conn):
+        return search_samples(conn, db.partitions.attach(conn, days), q, after, limit)
 
-    return {"count": len(results), "results": results}
+    results, next_cursor = await read(query)
+    return {"results": results, "next_cursor": next_cursor}
 
 
-@app.get("/query/weak-filters")
-def weak_filters(ratio_lt: float = 0.2):
-    conn = get_conn()
-    cur = conn.cursor()
+LATENCY_DIMENSIONS = ("pipeline_name", "step_name", "step_type")
 
-    rows = cur.execute("""
-        SELECT * FROM steps
-        WHERE step_type = 'filter'
-    """).fetchall()
 
-    results = []
-    for r in rows:
-        metrics = json.loads(r["metrics_json"] or "{}")
-        if metrics.get("filtered_ratio", 1) < ratio_lt:
-            results.append(dict(r))
+def latency_scopes(params):
+    if params["step_type"]:
+        return (f"step_type:{params['step_type']}",)
+    if params["pipeline"]:
+        return pipeline_scopes(params["pipeline"])
+    return ("steps",)
+
+
+@app.get("/query/latency")
+@cached(latency_scopes)
+async def latency(
+    group_by: list[Literal["pipeline_name", "step_name", "step_type"]] = Query(["step_type"]),
+    bucket: Literal["minute", "hour", "day"] | None = None,
+    pipeline: str | None = None,
+    step_name: str | None = None,
+    step_type: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+):
+    """
+    Step latency p50/p95/p99 (ms) per group and optional time bucket, read
+    from the per-minute latency_histograms (latency.py) rather than steps.
+    Windows are minute-aligned: since/until are cut to the minute.
+    """
+    columns = list(dict.fromkeys(group_by))
+    if bucket:
+        columns.append(f"substr(minute, 1, {TIME_BUCKETS[bucket]}) AS bucket")
+
+    conditions, params = [], []
+    for column, value in zip(LATENCY_DIMENSIONS, (pipeline, step_name, step_type)):
+        if value:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if since:
+        conditions.append("minute >= substr(?, 1, 16)")
+        params.append(since)
+    if until:
+        conditions.append("minute < substr(?, 1, 16)")
+        params.append(until)
+
+    keys = ", ".join(str(i + 1) for i in range(len(columns)))
+    sql = f"""
+        SELECT {", ".join(columns)}, bin, SUM(count) AS count
+        FROM latency_histograms
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        GROUP BY {keys}, bin
+        ORDER BY {keys}
+    """
+    rows = await read(lambda conn: conn.execute(sql, params).fetchall())
+
+    groups = {}
+    for row in rows:
+        group = tuple(row[:-2])
+        groups.setdefault(group, {})[row["bin"]] = row["count"]
+
+    names = [c.split(" AS ")[-1] for c in columns]
+    return {
+        "groups": [
+            {**dict(zip(names, group)), **percentiles(bins)} for group, bins in groups.items()
+        ]
+    }
+
+
+@app.get("/query/diff")
+async def diff(
+    a: str,
+    b: str,
+    samples_limit: int = Query(DEFAULT_SAMPLE_IDS, ge=0, le=MAX_PAGE_SIZE),
+):
+    """
+    Compare two runs (typically of the same pipeline): steps aligned by
+    step_name and occurrence, with changed input / output / metrics /
+    context fields and candidate sample set differences per step.
+    `samples_limit` caps each listed candidate id set.
+    """
+    result = await read(lambda conn: diff_runs(conn, db.partitions, a, b, samples_limit))
+    if result is None:
+        raise HTTPException(status_code=404, detail="run not found")
+    return result
+
+
+def anomaly_scopes(params):
+    return pipeline_scopes(params["pipeline"]) if params["pipeline"] else ("steps",)
+
+
+def anomaly_conditions(pipeline, step_name, metric, since, until):
+    conditions, params = [], []
+    filters = (("pipeline_name", pipeline), ("step_name", step_name), ("metric", metric))
+    for column, value in filters:
+        if value:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if since:
+        conditions.append("created_at >= ?")
+        params.append(since)
+    if until:
+        conditions.append("created_at < ?")
+        params.append(until)
+    return conditions, params
+
+
+AnomalyMetric = Literal["filtered_ratio", "approved_count", "latency_ms", "failure"]
+
+
+@app.get("/query/anomalies")
+@cached(anomaly_scopes)
+async def query_anomalies(
+    pipeline: str | None = None,
+    step_name: str | None = None,
+    metric: AnomalyMetric | None = None,
+    min_z: float | None = Query(None, ge=0),
+    since: str | None = None,
+    until: str | None = None,
+    limit: int | None = Query(None, ge=1),
+    after: str | None = None,
+    format: Literal["json", "ndjson"] = "json",
+):
+    """
+    Steps flagged at ingest (anomalies.py) newest first: a filtered_ratio,
+    approved_count, latency_ms or failure value more than XRAY_ANOMALY_Z
+    standard deviations from the running mean of the same pipeline and
+    step_name. `min_z` narrows to larger deviations.
+    """
+    conditions, params = anomaly_conditions(pipeline, step_name, metric, since, until)
+    if min_z is not None:
+        conditions.append("abs(z) >= ?")
+        params.append(min_z)
+
+    page = await paginate(
+        db,
+        "SELECT * FROM step_anomalies",
+        conditions,
+        params,
+        after=after,
+        limit=limit,
+        format=format,
+        key=("created_at", "step_id", "metric"),
+        descending=True,
+    )
+    if format == "ndjson":
+        return page
+
+    results, next_cursor = page
+    return {"results": results, "next_cursor": next_cursor}
+
+
+@app.get("/query/anomalies/summary")
+@cached(anomaly_scopes)
+async def anomalies_summary(
+    pipeline: str | None = None,
+    step_name: str | None = None,
+    metric: AnomalyMetric | None = None,
+    since: str | None = None,
+    until: str | None = None,
+):
+    """
+    Which steps are least stable: anomaly and flagged-run counts per
+    (pipeline, step_name, metric), most anomalies first, with the running
+    n / mean / stddev they were measured against.
+    """
+    conditions, params = anomaly_conditions(pipeline, step_name, metric, since, until)
+    sql = f"""
+        SELECT a.pipeline_name, a.step_name, a.metric,
+               COUNT(*) AS anomalies, COUNT(DISTINCT a.run_id) AS runs,
+               st.n, st.mean, st.m2
+        FROM step_anomalies a
+        JOIN step_stats st USING (pipeline_name, step_name, metric)
+        {"WHERE " + " AND ".join(f"a.{c}" for c in conditions) if conditions else ""}
+        GROUP BY 1, 2, 3
+        ORDER BY anomalies DESC
+    """
+    rows = await read(lambda conn: conn.execute(sql, params).fetchall())
+
+    groups = []
+    for row in rows:
+        group = dict(row)
+        group["stddev"] = stddev(group["n"], group.pop("m2"))
+        groups.append(group)
+    return {"total": sum(g["anomalies"] for g in groups), "groups": groups}
+
 
-    conn.close()
-    return {"results": results}
+@app.get("/query/cache/stats")
+async def cache_stats():
+    """Hit/miss/eviction counters of the query result cache, for tuning its size and TTL."""
+    return query_cache.stats()
@@ -0,0 +1,117 @@
+"""
+In-process cache for /query/* results.
+
+Entries are keyed on endpoint + parameters, evicted least recently used
+beyond `max_entries`, and expire after `ttl` seconds. Each entry also
+records the generation of the write scopes it depends on ("steps",
+"step_type:filter", "pipeline:<name>", ...); ingest bumps the scopes it
+touched once its write has committed, which invalidates exactly the
+entries that could have changed. Retention and cold-tier moves bump
+nothing; the TTL bounds how long a result can outlive them.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+CACHE_SIZE = int(os.environ.get("XRAY_QUERY_CACHE_SIZE", 256))  # 0 disables
+CACHE_TTL_S = float(os.environ.get("XRAY_QUERY_CACHE_TTL_S", 30))
+
+# a write whose pipeline isn't known bumps this scope instead
+UNKNOWN_PIPELINE = "pipeline:?"
+
+
+def pipeline_scopes(pipeline):
+    return (f"pipeline:{pipeline}", UNKNOWN_PIPELINE)
+
+
+def write_scopes(runs=(), steps=()):
+    """The scopes an ingest write of `runs` and `steps` bumps."""
+    scopes = set()
+    if runs:
+        scopes.add("runs")
+    if steps:
+        scopes.add("steps")
+    for record in (*runs, *steps):
+        pipeline = record.pipeline_name
+        scopes.add(f"pipeline:{pipeline}" if pipeline else UNKNOWN_PIPELINE)
+    for step in steps:
+        scopes.add(f"step_type:{step.step_type}")
+    return scopes
+
+
+class ResultCache:
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, generations, value)
+        self._generations = defaultdict(int)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidated = 0
+        self.evictions = 0
+
+    async def get_or_compute(self, key, scopes, compute):
+        """Cached result for `key`, else `await compute()` and keep it."""
+        if not self.max_entries:
+            return await compute()
+
+        scopes = tuple(scopes)
+        with self._lock:
+            generations = self._stamp(scopes)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, stamped, value = entry
+                if expires > time.monotonic() and stamped == generations:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if stamped != generations:
+                    self.invalidated += 1
+                else:
+                    self.expired += 1
+                del self._entries[key]
+            self.misses += 1
+
+        # stamped before computing: a write committing meanwhile makes the
+        # result stale on arrival, never the other way round
+        value = await compute()
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, generations, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def bump(self, scopes):
+        """Invalidate every entry depending on any of `scopes` (called after commit)."""
+        with self._lock:
+            for scope in scopes:
+                self._generations[scope] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "expired": self.expired,
+                "invalidated": self.invalidated,
+                "evictions": self.evictions,
+            }
+
+    def _stamp(self, scopes):
+        return tuple(self._generations.get(s, 0) for s in scopes)
@@ -0,0 +1,192 @@
+"""
+Request body codecs for the ingest endpoints.
+
+Clients may send JSON (the default) or MessagePack, optionally compressed
+with gzip, deflate or zstd, negotiated per request through Content-Type
+and Content-Encoding. msgpack and zstandard are optional dependencies: if
+one is missing the server answers 415 and the SDK falls back to plain JSON.
+
+Decompressed bodies are capped (413 above the cap) and inflated a bounded
+piece at a time, so a small compressed body can't expand without limit.
+"""
+import json
+import os
+import zlib
+
+from fastapi import HTTPException, Request
+from fastapi.routing import APIRoute
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+# decompressed size of a request body read whole (run, step, batch)
+MAX_BODY_BYTES = int(os.environ.get("XRAY_MAX_BODY_BYTES", 64 * 1024 * 1024))
+# decompressed size of a streamed /ingest/samples upload
+MAX_UPLOAD_BYTES = int(os.environ.get("XRAY_MAX_UPLOAD_BYTES", 1024 * 1024 * 1024))
+
+# most output a single inflate step may produce
+PIECE_BYTES = 1024 * 1024
+# zstd's decompressobj takes no output limit, so it is fed slices this small
+# instead: at zstd's worst-case ratio (~32k:1) a slice inflates to 2 MiB
+ZSTD_SLICE = 64
+
+
+def decompressor(encoding):
+    """An object with decompress(chunk)/flush() for a Content-Encoding, or None for identity."""
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return None
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise HTTPException(status_code=415, detail=f"unsupported encoding {encoding}")
+
+
+def decompress(body, encoding, limit=MAX_BODY_BYTES):
+    decoder = BodyDecoder(encoding, limit)
+    if not body:
+        return body
+    return b"".join(decoder.decompress(body)) + decoder.flush()
+
+
+class BodyDecoder:
+    """
+    Incremental decompression of a request body streamed in chunks.
+    decompress() yields each chunk's output in pieces of at most
+    PIECE_BYTES. Corrupt input is answered with 400, and output past
+    `limit` bytes in total with 413.
+    """
+
+    def __init__(self, encoding, limit=MAX_BODY_BYTES):
+        self.encoding = encoding
+        self.limit = limit
+        self.size = 0
+        self._decoder = decompressor(encoding)
+        # zlib takes an output limit per call; zstd is fed small slices
+        zlib_based = (encoding or "").strip().lower() in ("gzip", "deflate")
+        self._inflate = self._inflate_bounded if zlib_based else self._inflate_slices
+
+    def decompress(self, chunk):
+        # request.stream() ends with an empty chunk, which zstd rejects once
+        # its frame is complete
+        if not chunk:
+            return
+        if self._decoder is None:
+            yield self._count(chunk)
+            return
+        try:
+            yield from self._inflate(chunk)
+        except HTTPException:
+            raise
+        except Exception:
+            raise self._invalid() from None
+
+    def flush(self):
+        if self._decoder is None:
+            return b""
+        try:
+            return self._count(self._decoder.flush())
+        except HTTPException:
+            raise
+        except Exception:
+            raise self._invalid() from None
+
+    def _inflate_bounded(self, data):
+        while data:
+            piece = self._decoder.decompress(data, PIECE_BYTES)
+            data = self._decoder.unconsumed_tail
+            if piece:
+                yield self._count(piece)
+
+    def _inflate_slices(self, data):
+        pieces, size = [], 0
+        for i in range(0, len(data), ZSTD_SLICE):
+            piece = self._decoder.decompress(data[i:i + ZSTD_SLICE])
+            pieces.append(piece)
+            size += len(piece)
+            if size >= PIECE_BYTES:
+                yield self._count(b"".join(pieces))
+                pieces, size = [], 0
+        if size:
+            yield self._count(b"".join(pieces))
+
+    def _count(self, piece):
+        self.size += len(piece)
+        if self.size > self.limit:
+            raise HTTPException(
+                status_code=413, detail=f"body exceeds {self.limit} bytes once decompressed"
+            )
+        return piece
+
+    def _invalid(self):
+        return HTTPException(status_code=400, detail=f"invalid {self.encoding} body")
+
+
+def media_type(content_type):
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+class CodecRequest(Request):
+    """
+    A Request whose body() is decompressed and whose json() also decodes
+    MessagePack. A msgpack Content-Type is reported as JSON so FastAPI
+    parses the body into the endpoint's pydantic model as usual.
+    """
+
+    def __init__(self, scope, receive):
+        headers = dict(Request(scope).headers)
+        self.wire_type = media_type(headers.get("content-type"))
+        self.wire_encoding = headers.get("content-encoding")
+
+        if self.wire_type in MSGPACK_TYPES:
+            if msgpack is None:
+                raise HTTPException(status_code=415, detail="msgpack is not supported")
+            scope = dict(scope)
+            scope["headers"] = [
+                (k, b"application/json" if k == b"content-type" else v)
+                for k, v in scope["headers"]
+            ]
+        super().__init__(scope, receive)
+
+    async def body(self):
+        if not hasattr(self, "_decoded"):
+            self._decoded = decompress(await super().body(), self.wire_encoding)
+        return self._decoded
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            if self.wire_type in MSGPACK_TYPES:
+                try:
+                    self._json = msgpack.unpackb(body, raw=False, strict_map_key=False)
+                except Exception:
+                    raise HTTPException(status_code=400, detail="invalid msgpack body") from None
+            else:
+                self._json = json.loads(body)
+        return self._json
+
+
+class CodecRoute(APIRoute):
+    """Route class that hands endpoints a CodecRequest."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request):
+            if request.method in ("GET", "HEAD"):
+                return await handler(request)
+            return await handler(CodecRequest(request.scope, request.receive))
+
+        return route_handler
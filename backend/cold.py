@@ -0,0 +1,406 @@
+"""
+Cold tier: aged days exported to Parquet for offline analytics.
+
+Once a day is older than XRAY_COLD_AFTER_DAYS, the maintenance thread
+copies its runs, steps and candidate samples to
+`<cold dir>/<table>/day=YYYY-MM-DD/part-*.parquet` (tables `runs`, `steps`,
+`samples`) and removes them from the hot database, so scans over history
+no longer compete with ingestion for SQLite. Steps carry their run's
+pipeline_name and started_at, and numeric metrics are flattened into
+float columns named `metrics.<key>` next to metrics_json.
+
+The /query/* endpoints read these files with `tier=cold`. Needs pyarrow.
+"""
+import json
+import os
+import shutil
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+
+from fastapi.responses import StreamingResponse
+
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from .partitions import DAY, schema_name
+from .runs import JSON_COLUMNS
+
+COLD_AFTER_DAYS = int(os.environ.get("XRAY_COLD_AFTER_DAYS", 0))  # 0 keeps everything hot
+# defaults to <db name>-cold/ next to the db
+COLD_DIR = os.environ.get("XRAY_COLD_DIR")
+EXPORT_CHUNK = int(os.environ.get("XRAY_COLD_EXPORT_CHUNK", 50_000))  # rows per part file
+NDJSON_BATCH = 500
+
+TABLES = ("runs", "steps", "samples")
+
+# SQLite declared type -> Arrow type; anything else is exported as text
+SQL_TYPES = {"INTEGER": "int64", "REAL": "double"}
+
+# runs still receiving steps stay hot until those steps age out too
+RUNS_EXPORT_SQL = """
+    SELECT r.*, s.status, s.step_count, s.total_latency_ms, s.max_latency_ms,
+           s.first_failure_mode, s.duration_ms
+    FROM run_summaries s
+    JOIN runs r ON r.run_id = s.run_id
+    WHERE s.started_at >= ? AND s.started_at < ?
+      AND NOT EXISTS (
+          SELECT 1 FROM steps WHERE steps.run_id = s.run_id AND steps.created_at >= ?
+      )
+"""
+
+STEPS_EXPORT_SQL = """
+    SELECT s.*, r.pipeline_name, r.started_at AS run_started_at
+    FROM steps s
+    LEFT JOIN runs r ON r.run_id = s.run_id
+    WHERE s.created_at >= ? AND s.created_at < ?
+"""
+
+# columns the export adds for analytics (besides metrics.*), left out of
+# the /query/run document so it reads the same from either tier
+EXPORT_COLUMNS = {
+    "runs": {
+        "status", "step_count", "total_latency_ms", "max_latency_ms",
+        "first_failure_mode", "duration_ms",
+    },
+    "steps": {"pipeline_name", "run_started_at"},
+    "samples": set(),
+}
+
+FAILURE_COLUMNS = {
+    "step_id": "step_id",
+    "run_id": "run_id",
+    "step_name": "step_name",
+    "step_type": "step_type",
+    "created_at": "created_at",
+    "pipeline_name": "pipeline_name",
+    "started_at": "run_started_at",
+    "failure_mode": "failure_mode",
+}
+
+
+def next_day(day):
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def export_days(conn, partitions, cutoff, floor=""):
+    """Days in [floor, cutoff) that still have data in the hot database."""
+    days = set(partitions.days())
+    days.update(
+        r[0]
+        for r in conn.execute(
+            "SELECT DISTINCT substr(created_at, 1, 10) FROM steps WHERE created_at < ?", (cutoff,)
+        )
+    )
+    days.update(
+        r[0]
+        for r in conn.execute(
+            "SELECT DISTINCT substr(started_at, 1, 10) FROM run_summaries WHERE started_at < ?",
+            (cutoff,),
+        )
+    )
+    return sorted(d for d in days if d and DAY.match(d) and floor <= d < cutoff)
+
+
+def flatten_metrics(table):
+    """Numeric metrics as float columns `metrics.<key>`; metrics_json is kept as is."""
+    columns = {}
+    for i, text in enumerate(table.column("metrics_json").to_pylist()):
+        try:
+            metrics = json.loads(text) if text else {}
+        except ValueError:
+            continue
+        if not isinstance(metrics, dict):
+            continue
+        for key, value in metrics.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                columns.setdefault(key, [None] * table.num_rows)[i] = float(value)
+
+    for key in sorted(columns):
+        table = table.append_column(
+            pa.field(f"metrics.{key}", pa.float64()), pa.array(columns[key], pa.float64())
+        )
+    return table
+
+
+class ColdStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self._datasets = {}
+
+    @property
+    def available(self):
+        return pa is not None
+
+    def days(self):
+        return sorted({d.name[4:] for t in TABLES for d in (self.root / t).glob("day=*")})
+
+    def drop_before(self, cutoff):
+        """Delete every exported day before `cutoff`."""
+        for table in TABLES:
+            for directory in (self.root / table).glob("day=*"):
+                if directory.name[4:] < cutoff:
+                    shutil.rmtree(directory, ignore_errors=True)
+
+    # --------- EXPORT ---------
+    def export_day(self, conn, partitions, day, cutoff):
+        """
+        Copy `day` from the hot database, read through `conn`. Returns the
+        keys written (run_ids, step_ids, highest sample id) so the caller
+        deletes exactly those rows, not ones that arrived meanwhile.
+        """
+        end = next_day(day)
+        run_ids = self._export(
+            conn, "runs", day, RUNS_EXPORT_SQL, (day, end, cutoff), ("runs", "run_summaries")
+        )
+        step_ids = self._export(
+            conn, "steps", day, STEPS_EXPORT_SQL, (day, end), ("steps", "runs"), flatten_metrics
+        )
+
+        max_sample_id = None
+        if day in partitions.attach(conn, [day]):
+            sql = f"SELECT * FROM {schema_name(day)}.candidate_samples"
+            max_sample_id = max(
+                self._export(conn, "samples", day, sql, (), ("candidate_samples",)), default=None
+            )
+        return run_ids, step_ids, max_sample_id
+
+    def _export(self, conn, table, day, sql, params, sources, transform=None):
+        cur = conn.execute(sql, params)
+        names = [d[0] for d in cur.description]
+        types = _column_types(conn, sources)
+        schema = pa.schema([(n, pa.type_for_alias(types.get(n, "string"))) for n in names])
+
+        keys = []
+        while rows := cur.fetchmany(EXPORT_CHUNK):
+            columns = {n: [r[i] for r in rows] for i, n in enumerate(names)}
+            part = pa.table(columns, schema=schema)
+            if transform:
+                part = transform(part)
+            self._write(table, day, part)
+            keys.extend(columns[names[0]])
+        return keys
+
+    def _write(self, table, day, part):
+        directory = self.root / table / f"day={day}"
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"part-{uuid.uuid4().hex}.parquet"
+        # dot-prefixed files are skipped by readers until the rename
+        pq.write_table(part, directory / f".{name}", compression="zstd")
+        os.replace(directory / f".{name}", directory / name)
+
+    # --------- QUERIES ---------
+    def dataset(self, table):
+        """A dataset over every part file of `table`, or None if there are none."""
+        files = tuple(sorted(str(p) for p in (self.root / table).glob("day=*/part-*.parquet")))
+        cached = self._datasets.get(table)
+        if cached and cached[0] == files:
+            return cached[1]
+
+        dataset = None
+        if files:
+            # part files differ in which metrics.* columns they have
+            day = pa.schema([("day", pa.string())])
+            schema = pa.unify_schemas([pq.read_schema(f) for f in files] + [day])
+            dataset = ds.dataset(
+                list(files),
+                schema=schema,
+                format="parquet",
+                partitioning=ds.partitioning(day, flavor="hive"),
+                partition_base_dir=str(self.root / table),
+            )
+        self._datasets[table] = (files, dataset)
+        return dataset
+
+    def scan(self, table, filter=None, columns=None):
+        dataset = self.dataset(table)
+        if dataset is None:
+            return None
+        if columns is None:
+            columns = [n for n in dataset.schema.names if n != "day"]
+        elif isinstance(columns, dict):
+            columns = {name: ds.field(source) for name, source in columns.items()}
+        return dataset.to_table(columns=columns, filter=filter)
+
+    def count(self, table, filter=None):
+        dataset = self.dataset(table)
+        return 0 if dataset is None else dataset.count_rows(filter=filter)
+
+    def paginate(
+        self,
+        table,
+        filter=None,
+        after=None,
+        limit=None,
+        format="json",
+        key=("created_at", "step_id"),
+        descending=False,
+        columns=None,
+    ):
+        """Keyset pagination over a cold table; same contract as pagination.paginate."""
+        if after:
+            filter = _and(filter, _after(key, decode_cursor(after, len(key)), descending))
+        rows = self.scan(table, filter, columns)
+
+        if format == "ndjson":
+            rows = _top(rows, key, descending, limit)
+            return StreamingResponse(_stream(rows), media_type="application/x-ndjson")
+
+        limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        rows = _top(rows, key, descending, limit + 1)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(*(rows[-1][k] for k in key))
+        return rows, next_cursor
+
+    def run(self, run_id, samples=False, samples_limit=None):
+        """
+        (JSON text, ended_at) of the run document, shaped like
+        runs.run_document: JSON columns decoded, export-only columns left out.
+        """
+        runs = self._document_rows("runs", ds.field("run_id") == run_id)
+        run = runs[0] if runs else None
+
+        condition = ds.field("run_id") == run_id
+        if run and run.get("started_at"):
+            # a run's steps can't predate it: skip older day directories
+            condition &= ds.field("day") >= run["started_at"][:10]
+        steps = self._document_rows("steps", condition)
+        steps.sort(key=lambda s: (s["created_at"] or "", s["step_id"]))
+
+        if samples and steps:
+            by_step = {s["step_id"]: [] for s in steps}
+            condition = ds.field("step_id").isin(list(by_step))
+            condition &= ds.field("day") >= min(s["created_at"] or "" for s in steps)[:10]
+            rows = self._document_rows("samples", condition)
+            for sample in sorted(rows, key=lambda r: r["id"]):
+                kept = by_step[sample["step_id"]]
+                if samples_limit is None or len(kept) < samples_limit:
+                    kept.append(sample)
+            for step in steps:
+                step["samples"] = by_step[step["step_id"]]
+
+        body = json.dumps({"run": run, "steps": steps}, separators=(",", ":"))
+        return body, run["ended_at"] if run else None
+
+    def _document_rows(self, table, condition):
+        dataset = self.dataset(table)
+        if dataset is None:
+            return []
+        columns = [
+            n for n in dataset.schema.names
+            if n != "day" and n not in EXPORT_COLUMNS[table] and not n.startswith("metrics.")
+        ]
+        rows = dataset.to_table(columns=columns, filter=condition).to_pylist()
+        for row in rows:
+            for name in JSON_COLUMNS.intersection(row):
+                row[name] = _json_value(row[name])
+        return rows
+
+    def failure_counts(self, group_by, bucket=None, mode=None, since=None, until=None):
+        """/query/failures/summary over cold steps; `bucket` is a created_at prefix length."""
+        condition = failures(mode)
+        if since:
+            condition &= ds.field("created_at") >= since
+        if until:
+            condition &= ds.field("created_at") < until
+
+        keys = list(dict.fromkeys(group_by))
+        steps = self.scan("steps", condition, keys + ["created_at", "step_id"])
+        if steps is None or not steps.num_rows:
+            return []
+        if bucket:
+            steps = steps.append_column(
+                "bucket", pc.utf8_slice_codeunits(steps.column("created_at"), 0, bucket)
+            )
+            keys.append("bucket")
+
+        counts = steps.group_by(keys).aggregate([("step_id", "count")])
+        counts = counts.rename_columns([*keys, "count"])
+        return counts.sort_by([("count", "descending")]).to_pylist()
+
+
+def _column_types(conn, tables):
+    types = {}
+    for table in tables:
+        for _, name, declared, *_ in conn.execute(f"PRAGMA main.table_info({table})"):
+            types.setdefault(name, SQL_TYPES.get(declared.upper(), "string"))
+    return types
+
+
+def _json_value(text):
+    # as json_valid() in run_document: malformed text reads as null
+    try:
+        return json.loads(text) if text is not None else None
+    except ValueError:
+        return None
+
+
+def _and(left, right):
+    return right if left is None else left & right
+
+
+def _after(key, values, descending):
+    """Rows strictly past the cursor `values` in `key` order."""
+    column, rest = ds.field(key[0]), key[1:]
+    past = column < values[0] if descending else column > values[0]
+    if not rest:
+        return past
+    return past | ((column == values[0]) & _after(rest, values[1:], descending))
+
+
+def _top(rows, key, descending, limit=None):
+    """The first `limit` rows in key order, as dicts."""
+    if rows is None:
+        return []
+    order = [(k, "descending" if descending else "ascending") for k in key]
+    if limit and limit < rows.num_rows:
+        rows = rows.take(pc.select_k_unstable(rows, limit, order))
+    return rows.sort_by(order).to_pylist()
+
+
+def _stream(rows):
+    for i in range(0, len(rows), NDJSON_BATCH):
+        yield "".join(json.dumps(r, default=str) + "\n" for r in rows[i:i + NDJSON_BATCH])
+
+
+# filters of the /query/* endpoints, mirroring their SQL conditions
+def filter_events(ratio_gt):
+    above = ds.field("filtered_ratio") > ratio_gt
+    if ratio_gt < 0:
+        above |= ds.field("filtered_ratio").is_null()
+    return (ds.field("step_type") == "filter") & above
+
+
+def weak_filters(ratio_lt):
+    weak = ds.field("filtered_ratio") < ratio_lt
+    if ratio_lt > 1:
+        weak |= ds.field("filtered_ratio").is_null()
+    return (ds.field("step_type") == "filter") & weak
+
+
+def failures(mode=None):
+    if mode:
+        return ds.field("failure_mode") == mode
+    return ds.field("failure_mode").is_valid()
+
+
+def runs(pipeline=None, status=None, since=None, until=None):
+    condition = None
+    if pipeline:
+        condition = _and(condition, ds.field("pipeline_name") == pipeline)
+    if status:
+        condition = _and(condition, ds.field("status") == status)
+    if since:
+        condition = _and(condition, ds.field("started_at") >= since)
+    if until:
+        condition = _and(condition, ds.field("started_at") < until)
+    return condition
@@ -1,7 +1,44 @@
+import asyncio
+import logging
+import os
+import queue
 import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent / "xray.db"
+from . import anomalies, latency
+from .cold import COLD_AFTER_DAYS, COLD_DIR, ColdStore, export_days
+from .partitions import MAX_ATTACHED, Partitions, day_of, schema_name
+from .retention import (
+    RETENTION_BATCH,
+    RETENTION_DAYS,
+    delete_expired,
+    delete_runs,
+    delete_steps,
+)
+
+DB_PATH = Path(os.environ.get("XRAY_DB_PATH", Path(__file__).parent / "xray.db"))
+# per-day candidate_samples files; defaults to <db name>-partitions/ next to the db
+PARTITION_DIR = os.environ.get("XRAY_DB_PARTITION_DIR")
+
+# Connection tuning, overridable from the environment
+READ_POOL_SIZE = int(os.environ.get("XRAY_DB_READ_POOL_SIZE", 4))
+BUSY_TIMEOUT_MS = int(os.environ.get("XRAY_DB_BUSY_TIMEOUT_MS", 5000))
+MMAP_SIZE = int(os.environ.get("XRAY_DB_MMAP_SIZE", 256 * 1024 * 1024))
+CACHE_SIZE = int(os.environ.get("XRAY_DB_CACHE_SIZE", -64_000))  # negative = KiB
+MAX_GROUP_COMMIT = int(os.environ.get("XRAY_DB_MAX_GROUP_COMMIT", 256))
+# queued writes before ingest is turned away with 503 (0 = unbounded)
+MAX_PENDING_WRITES = int(os.environ.get("XRAY_DB_MAX_PENDING_WRITES", 10_000))
+STREAM_CHUNK = int(os.environ.get("XRAY_DB_STREAM_CHUNK", 500))  # rows per fetch
+MAINTENANCE_INTERVAL_S = float(os.environ.get("XRAY_DB_MAINTENANCE_INTERVAL_S", 600))
+# a one-off VACUUM converts a database without incremental auto_vacuum
+# once this share of its pages is free
+VACUUM_FREE_RATIO = float(os.environ.get("XRAY_DB_VACUUM_FREE_RATIO", 0.25))
+
+logger = logging.getLogger(__name__)
 
 
 def get_conn():
@@ -9,62 +46,673 @@ def get_conn():
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
+    # INSERT OR REPLACE must fire the delete triggers that keep steps_fts in sync
+    conn.execute("PRAGMA recursive_triggers=ON;")
+    latency.register(conn)
     return conn
 
 
-def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
-
-    # Runs table = one pipeline execution
-    cur.execute(
+# Schema history. Each entry moves the database up one version and is a
+# list of SQL statements or callables taking the connection; the applied
+# version is tracked in PRAGMA user_version. Append, never edit.
+MIGRATIONS = [
+    # 1 — base tables
+    [
+        # Runs table = one pipeline execution
         """
-    CREATE TABLE IF NOT EXISTS runs (
-        run_id TEXT PRIMARY KEY,
-        pipeline_name TEXT,
-        input_summary TEXT,
-        outcome_summary TEXT,
-        started_at TEXT,
-        ended_at TEXT,
-        metadata_json TEXT
-    );
-    """
-    )
-
-    # Steps table = each decision stage
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS steps (
-        step_id TEXT PRIMARY KEY,
-        run_id TEXT,
-        step_name TEXT,
-        step_type TEXT,
-        input_summary TEXT,
-        output_summary TEXT,
-        metrics_json TEXT,
-        reasoning TEXT,
-        context_json TEXT,
-        created_at TEXT,
-        FOREIGN KEY(run_id) REFERENCES runs(run_id)
-    );
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY,
+            pipeline_name TEXT,
+            input_summary TEXT,
+            outcome_summary TEXT,
+            started_at TEXT,
+            ended_at TEXT,
+            metadata_json TEXT
+        );
+        """,
+        # Steps table = each decision stage
+        """
+        CREATE TABLE IF NOT EXISTS steps (
+            step_id TEXT PRIMARY KEY,
+            run_id TEXT,
+            step_name TEXT,
+            step_type TEXT,
+            input_summary TEXT,
+            output_summary TEXT,
+            metrics_json TEXT,
+            reasoning TEXT,
+            context_json TEXT,
+            created_at TEXT,
+            FOREIGN KEY(run_id) REFERENCES runs(run_id)
+        );
+        """,
+        # Optional sampled candidate details
+        """
+        CREATE TABLE IF NOT EXISTS candidate_samples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            step_id TEXT,
+            candidate_id TEXT,
+            attributes_json TEXT,
+            decision TEXT,
+            score REAL,
+            rejection_reason TEXT,
+            FOREIGN KEY(step_id) REFERENCES steps(step_id)
+        );
+        """,
+    ],
+    # 2 — secondary indexes for run traces, step_type scans and sample lookups
+    [
+        "CREATE INDEX IF NOT EXISTS idx_steps_run_created ON steps(run_id, created_at);",
+        "CREATE INDEX IF NOT EXISTS idx_steps_type_created ON steps(step_type, created_at);",
+        "CREATE INDEX IF NOT EXISTS idx_samples_step ON candidate_samples(step_id);",
+        "CREATE INDEX IF NOT EXISTS idx_runs_pipeline_started ON runs(pipeline_name, started_at);",
+    ],
+    # 3 — well-known metrics and context.failure_mode promoted to typed columns
+    [
+        "ALTER TABLE steps ADD COLUMN filtered_ratio REAL;",
+        "ALTER TABLE steps ADD COLUMN latency_ms REAL;",
+        "ALTER TABLE steps ADD COLUMN candidate_count INTEGER;",
+        "ALTER TABLE steps ADD COLUMN approved_count INTEGER;",
+        "ALTER TABLE steps ADD COLUMN failure_mode TEXT;",
+        """
+        UPDATE steps SET
+            filtered_ratio  = json_extract(metrics_json, '$.filtered_ratio'),
+            latency_ms      = json_extract(metrics_json, '$.latency_ms'),
+            candidate_count = json_extract(metrics_json, '$.count'),
+            approved_count  = json_extract(metrics_json, '$.approved_count'),
+            failure_mode    = json_extract(context_json, '$.failure_mode');
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_steps_type_ratio ON steps(step_type, filtered_ratio);",
+        "CREATE INDEX IF NOT EXISTS idx_steps_failure_mode ON steps(failure_mode);",
+    ],
+    # 4 — keyset pagination order (created_at, step_id) for the /query/* scans
+    [
+        "DROP INDEX IF EXISTS idx_steps_type_created;",
+        "CREATE INDEX IF NOT EXISTS idx_steps_type_page ON steps(step_type, created_at, step_id);",
+        "CREATE INDEX IF NOT EXISTS idx_steps_page ON steps(created_at, step_id);",
+    ],
+    # 5 — failure_mode equality filter served in page order
+    [
+        "DROP INDEX IF EXISTS idx_steps_failure_mode;",
+        "CREATE INDEX IF NOT EXISTS idx_steps_failure_page ON steps(failure_mode, created_at, step_id);",
+    ],
+    # 6 — per-run rollups kept up to date at ingest, for listing runs
+    [
+        """
+        CREATE TABLE IF NOT EXISTS run_summaries (
+            run_id TEXT PRIMARY KEY,
+            pipeline_name TEXT,
+            started_at TEXT,
+            ended_at TEXT,
+            status TEXT,
+            step_count INTEGER,
+            total_latency_ms REAL,
+            max_latency_ms REAL,
+            first_failure_mode TEXT,
+            duration_ms REAL,
+            FOREIGN KEY(run_id) REFERENCES runs(run_id)
+        );
+        """,
+        """
+        INSERT OR REPLACE INTO run_summaries
+        SELECT
+            run_id, pipeline_name, started_at, ended_at,
+            CASE
+                WHEN first_failure_mode IS NOT NULL THEN 'failed'
+                WHEN ended_at IS NOT NULL THEN 'completed'
+                ELSE 'running'
+            END,
+            step_count, total_latency_ms, max_latency_ms, first_failure_mode,
+            round((julianday(ended_at) - julianday(started_at)) * 86400000, 2)
+        FROM (
+            SELECT
+                r.run_id, r.pipeline_name, r.started_at, r.ended_at,
+                COUNT(s.step_id) AS step_count,
+                round(SUM(s.latency_ms), 3) AS total_latency_ms,
+                MAX(s.latency_ms) AS max_latency_ms,
+                (SELECT failure_mode FROM steps
+                 WHERE run_id = r.run_id AND failure_mode IS NOT NULL
+                 ORDER BY created_at, step_id LIMIT 1) AS first_failure_mode
+            FROM runs r
+            LEFT JOIN steps s ON s.run_id = r.run_id
+            GROUP BY r.run_id
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_run_summaries_page ON run_summaries(started_at, run_id);",
+        """
+        CREATE INDEX IF NOT EXISTS idx_run_summaries_pipeline_page
+        ON run_summaries(pipeline_name, started_at, run_id);
+        """,
+    ],
+    # 7 — full-text index over step reasoning and output, kept in sync by triggers.
+    # INSERT OR REPLACE only fires the delete trigger with recursive_triggers on,
+    # which every connection from this module sets.
+    [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS steps_fts USING fts5(
+            reasoning, output_summary, content='steps', content_rowid='rowid'
+        );
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS steps_fts_insert AFTER INSERT ON steps BEGIN
+            INSERT INTO steps_fts(rowid, reasoning, output_summary)
+            VALUES (new.rowid, new.reasoning, new.output_summary);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS steps_fts_delete AFTER DELETE ON steps BEGIN
+            INSERT INTO steps_fts(steps_fts, rowid, reasoning, output_summary)
+            VALUES ('delete', old.rowid, old.reasoning, old.output_summary);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS steps_fts_update AFTER UPDATE ON steps BEGIN
+            INSERT INTO steps_fts(steps_fts, rowid, reasoning, output_summary)
+            VALUES ('delete', old.rowid, old.reasoning, old.output_summary);
+            INSERT INTO steps_fts(rowid, reasoning, output_summary)
+            VALUES (new.rowid, new.reasoning, new.output_summary);
+        END;
+        """,
+        "INSERT INTO steps_fts(steps_fts) VALUES ('rebuild');",
+    ],
+    # 8 — per-minute step latency histograms (latency.py), counted at ingest
+    [
+        """
+        CREATE TABLE IF NOT EXISTS latency_histograms (
+            minute TEXT NOT NULL,
+            pipeline_name TEXT NOT NULL,
+            step_name TEXT NOT NULL,
+            step_type TEXT NOT NULL,
+            bin INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (minute, pipeline_name, step_name, step_type, bin)
+        ) WITHOUT ROWID;
+        """,
+        latency.backfill,
+    ],
+    # 9 — running per-(pipeline, step_name) metric statistics and the steps
+    # they flagged (anomalies.py), updated at ingest
+    [
+        """
+        CREATE TABLE IF NOT EXISTS step_stats (
+            pipeline_name TEXT NOT NULL,
+            step_name TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            mean REAL NOT NULL,
+            m2 REAL NOT NULL,
+            PRIMARY KEY (pipeline_name, step_name, metric)
+        ) WITHOUT ROWID;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS step_anomalies (
+            step_id TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            run_id TEXT,
+            pipeline_name TEXT NOT NULL,
+            step_name TEXT NOT NULL,
+            created_at TEXT,
+            value REAL NOT NULL,
+            mean REAL NOT NULL,
+            stddev REAL NOT NULL,
+            z REAL NOT NULL,
+            PRIMARY KEY (step_id, metric)
+        );
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_step_anomalies_created
+        ON step_anomalies(created_at, step_id, metric);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_step_anomalies_step
+        ON step_anomalies(pipeline_name, step_name, created_at);
+        """,
+        anomalies.backfill,
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn, target=SCHEMA_VERSION):
+    """Apply pending migrations up to `target`, one transaction per version."""
+    version = conn.execute("PRAGMA user_version;").fetchone()[0]
+
+    for v in range(version + 1, target + 1):
+        conn.execute("BEGIN")
+        try:
+            for step in MIGRATIONS[v - 1]:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version={v};")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    return max(version, target)
+
+
+def init_db(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = get_conn()
+
+    migrate(conn)
+
+    if own_conn:
+        conn.close()
+
+
+class Database:
     """
-    )
-
-    # Optional sampled candidate details
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS candidate_samples (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        step_id TEXT,
-        candidate_id TEXT,
-        attributes_json TEXT,
-        decision TEXT,
-        score REAL,
-        rejection_reason TEXT,
-        FOREIGN KEY(step_id) REFERENCES steps(step_id)
-    );
+    Long-lived connections for the API process.
+
+    Reads borrow a connection from a fixed pool of read-only connections,
+    either directly (reader()) or as a callable run on a read executor with
+    one thread per pooled connection (read()), so async handlers never
+    block the event loop on SQLite. Writes are submitted as callables to a
+    single writer thread, which runs everything queued at that moment in
+    one transaction (group commit); each callable gets its own savepoint so
+    a failing write doesn't take the rest of the group down with it.
+
+    candidate_samples live in per-day partition files (partitions.py):
+    writes name the days they touch so the writer can attach them before
+    the transaction starts, and readers attach what they need via
+    `db.partitions.attach(conn, days)`. A maintenance thread applies the
+    retention policy, moves aged days to the cold tier (cold.py) and
+    checkpoints / vacuums through the writer.
     """
-    )
 
-    conn.commit()
-    conn.close()
+    _STOP = object()
+
+    def __init__(
+        self,
+        path=None,
+        pool_size=READ_POOL_SIZE,
+        busy_timeout_ms=BUSY_TIMEOUT_MS,
+        mmap_size=MMAP_SIZE,
+        cache_size=CACHE_SIZE,
+        max_group_commit=MAX_GROUP_COMMIT,
+        max_pending_writes=MAX_PENDING_WRITES,
+        partition_dir=None,
+        retention_days=RETENTION_DAYS,
+        maintenance_interval=MAINTENANCE_INTERVAL_S,
+        cold_dir=None,
+        cold_after_days=COLD_AFTER_DAYS,
+    ):
+        self.path = Path(path or DB_PATH)
+        self.partitions = Partitions(
+            partition_dir
+            or PARTITION_DIR
+            or self.path.with_name(self.path.stem + "-partitions")
+        )
+        self.cold = ColdStore(cold_dir or COLD_DIR or self.path.with_name(self.path.stem + "-cold"))
+        self.retention_days = retention_days
+        self.cold_after_days = cold_after_days
+        self.maintenance_interval = maintenance_interval
+        self.pool_size = pool_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.max_group_commit = max_group_commit
+        self.max_pending_writes = max_pending_writes
+
+        self._readers = None
+        self._read_pool = None
+        self._jobs = None
+        self._writer_conn = None
+        self._writer = None
+        self._maintainer = None
+        self._stopping = threading.Event()
+
+    def _connect(self, readonly=False):
+        if readonly:
+            conn = sqlite3.connect(
+                f"{self.path.resolve().as_uri()}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+        else:
+            # autocommit: the writer thread issues BEGIN/COMMIT itself
+            conn = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False
+            )
+            # only takes effect on a new file; see _compact for existing ones
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            conn.execute("PRAGMA recursive_triggers=ON;")  # see get_conn
+            latency.register(conn)
+
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)};")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)};")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)};")
+        return conn
+
+    # --------- LIFECYCLE ---------
+    def open(self):
+        self._writer_conn = self._connect()
+        init_db(self._writer_conn)
+        self._move_legacy_samples(self._writer_conn)
+        self._upgrade_partitions(self._writer_conn)
+
+        self._readers = queue.LifoQueue()
+        for _ in range(self.pool_size):
+            self._readers.put(self._connect(readonly=True))
+        self._read_pool = ThreadPoolExecutor(self.pool_size, thread_name_prefix="xray-db-read")
+
+        self._jobs = queue.Queue(self.max_pending_writes)
+        self._writer = threading.Thread(
+            target=self._write_loop, name="xray-db-writer", daemon=True
+        )
+        self._writer.start()
+
+        if self.cold_after_days and not self.cold.available:
+            logger.warning("cold tier export is configured but pyarrow is not installed; skipping it")
+
+        if self.maintenance_interval:
+            self._stopping.clear()
+            self._maintainer = threading.Thread(
+                target=self._maintenance_loop, name="xray-db-maintenance", daemon=True
+            )
+            self._maintainer.start()
+
+    def close(self):
+        if self._writer is None:
+            return
+
+        if self._maintainer is not None:
+            self._stopping.set()
+            self._maintainer.join()
+            self._maintainer = None
+
+        self._jobs.put(self._STOP)
+        self._writer.join()
+        self._writer = None
+
+        self._read_pool.shutdown()
+        self._writer_conn.close()
+        for _ in range(self.pool_size):
+            self._readers.get().close()
+
+    # --------- READS ---------
+    @contextmanager
+    def reader(self):
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def read(self, fn):
+        """Run `fn(conn)` on a pooled read connection in the read executor; returns a Future."""
+        return self._read_pool.submit(self._read, fn)
+
+    def _read(self, fn):
+        with self.reader() as conn:
+            return fn(conn)
+
+    async def iter_rows(self, sql, params=(), chunk_size=STREAM_CHUNK):
+        """
+        Async iterator over the rows of `sql`, fetched `chunk_size` at a time
+        on the read executor. Long streams use their own connection rather
+        than holding a pooled one.
+        """
+        conn = await asyncio.wrap_future(self._read_pool.submit(self._connect, True))
+        pending = None
+        try:
+            pending = self._read_pool.submit(conn.execute, sql, params)
+            cursor = await asyncio.wrap_future(pending)
+            while True:
+                pending = self._read_pool.submit(cursor.fetchmany, chunk_size)
+                rows = await asyncio.wrap_future(pending)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            # a client disconnect can cancel us mid-fetch: close once it's done
+            if pending is not None and not pending.done():
+                pending.add_done_callback(lambda _: conn.close())
+            else:
+                conn.close()
+
+    # --------- WRITES ---------
+    def write(self, fn, partitions=(), block=True):
+        """
+        Queue `fn(cursor)` for the writer thread; returns a Future.
+        `partitions` are the sample days `fn` writes to. When
+        `max_pending_writes` are already queued, waits for room, or raises
+        queue.Full with block=False.
+        """
+        if len(partitions) > MAX_ATTACHED:
+            raise ValueError(f"a write can touch at most {MAX_ATTACHED} partitions")
+        fut = Future()
+        self._jobs.put((fn, fut, frozenset(partitions), False), block)
+        return fut
+
+    def maintain(self, fn):
+        """Queue `fn(conn)` to run on the writer connection outside any transaction."""
+        fut = Future()
+        self._jobs.put((fn, fut, frozenset(), True))
+        return fut
+
+    def _write_loop(self):
+        carry = None
+        while True:
+            job = carry or self._jobs.get()
+            carry = None
+            if job is self._STOP:
+                return
+            if job[3]:
+                self._run_outside_transaction(job)
+                continue
+
+            group = [job]
+            days = set(job[2])
+            stop = False
+            while len(group) < self.max_group_commit:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is self._STOP:
+                    stop = True
+                    break
+                if job[3] or len(days | job[2]) > MAX_ATTACHED:
+                    carry = job  # starts the next group
+                    break
+                group.append(job)
+                days |= job[2]
+
+            self._commit_group(group, days)
+            if stop:
+                return
+
+    def _run_outside_transaction(self, job):
+        fn, fut, _, _ = job
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn(self._writer_conn)
+        except Exception as e:
+            fut.set_exception(e)
+        else:
+            fut.set_result(result)
+
+    def _commit_group(self, group, days=()):
+        conn = self._writer_conn
+        cur = conn.cursor()
+        outcomes = []
+
+        try:
+            # ATTACH isn't allowed inside a transaction
+            self.partitions.attach(conn, days, create=True)
+            cur.execute("BEGIN")
+            for fn, fut, _, _ in group:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                cur.execute("SAVEPOINT job")
+                try:
+                    result = fn(cur)
+                except Exception as e:
+                    cur.execute("ROLLBACK TO job")
+                    cur.execute("RELEASE job")
+                    outcomes.append((fut, None, e))
+                else:
+                    cur.execute("RELEASE job")
+                    outcomes.append((fut, result, None))
+            cur.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for _, fut, _, _ in group:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for fut, result, error in outcomes:
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+    # --------- PARTITIONS & MAINTENANCE ---------
+    def _move_legacy_samples(self, conn):
+        """Samples stored before partitioning sit in main.candidate_samples; move them to their day."""
+        if conn.execute("SELECT 1 FROM main.candidate_samples LIMIT 1").fetchone() is None:
+            return
+
+        keys = [
+            r[0]
+            for r in conn.execute(
+                "SELECT DISTINCT substr(s.created_at, 1, 10) FROM main.candidate_samples c"
+                " LEFT JOIN steps s ON s.step_id = c.step_id"
+            )
+        ]
+        legacy = """
+            SELECT c.id FROM main.candidate_samples c
+            LEFT JOIN steps s ON s.step_id = c.step_id
+            WHERE substr(s.created_at, 1, 10) IS ?
+        """
+        for key in keys:
+            day = day_of(key)
+            self.partitions.attach(conn, [day], create=True)
+            conn.execute("BEGIN")
+            conn.execute(
+                f"""
+                INSERT INTO {schema_name(day)}.candidate_samples
+                (step_id, candidate_id, attributes_json, decision, score, rejection_reason)
+                SELECT step_id, candidate_id, attributes_json, decision, score, rejection_reason
+                FROM main.candidate_samples WHERE id IN ({legacy})
+                """,
+                (key,),
+            )
+            conn.execute(f"DELETE FROM main.candidate_samples WHERE id IN ({legacy})", (key,))
+            conn.execute("COMMIT")
+        self.partitions.detach_except(conn)
+
+    def _upgrade_partitions(self, conn):
+        """Bring partition files created by an older version up to PARTITION_SCHEMA."""
+        for day in self.partitions.days():
+            self.partitions.attach(conn, [day], create=True)
+            self.partitions.detach_except(conn)
+
+    def _maintenance_loop(self):
+        while not self._stopping.wait(self.maintenance_interval):
+            try:
+                self.run_maintenance()
+            except Exception:
+                logger.exception("database maintenance failed")
+
+    def run_maintenance(self):
+        """
+        Apply retention, export aged days to the cold tier, then checkpoint
+        and vacuum; every change to the hot database goes through the writer.
+        """
+        today = datetime.utcnow().date()
+        expired = ""
+        if self.retention_days:
+            expired = (today - timedelta(days=self.retention_days)).isoformat()
+            self.maintain(lambda conn: self._drop_partitions(conn, expired)).result()
+            self.cold.drop_before(expired)
+            while self.write(lambda cur: delete_expired(cur, expired, RETENTION_BATCH)).result():
+                if self._stopping.is_set():
+                    break
+        if self.cold_after_days and self.cold.available:
+            self._export_cold((today - timedelta(days=self.cold_after_days)).isoformat(), expired)
+        self.maintain(self._compact).result()
+
+    def _export_cold(self, cutoff, floor=""):
+        """Move the days in [floor, cutoff) to the cold tier, one day at a time."""
+        conn = self._connect(readonly=True)
+        # runs go last: steps exported on later days still read their pipeline_name
+        run_ids = []
+        try:
+            for day in export_days(conn, self.partitions, cutoff, floor):
+                runs, step_ids, max_sample_id = self.cold.export_day(conn, self.partitions, day, cutoff)
+                self.partitions.detach_except(conn)
+                run_ids += runs
+                for i in range(0, len(step_ids), RETENTION_BATCH):
+                    batch = step_ids[i:i + RETENTION_BATCH]
+                    self.write(lambda cur, b=batch: delete_steps(cur, b)).result()
+                if max_sample_id is not None:
+                    self._forget_samples(day, max_sample_id)
+                if self._stopping.is_set():
+                    break
+        finally:
+            conn.close()
+            for i in range(0, len(run_ids), RETENTION_BATCH):
+                batch = run_ids[i:i + RETENTION_BATCH]
+                self.write(lambda cur, b=batch: delete_runs(cur, b)).result()
+
+    def _forget_samples(self, day, max_id):
+        """Drop a day's exported partition, unless samples arrived after the export."""
+        schema = schema_name(day)
+
+        def drop_if_exported(conn):
+            self.partitions.attach(conn, [day], create=True)
+            newest = conn.execute(f"SELECT MAX(id) FROM {schema}.candidate_samples").fetchone()[0]
+            if newest is not None and newest > max_id:
+                return False
+            self.partitions.detach_except(conn)
+            self.partitions.drop(day)
+            return True
+
+        if not self.maintain(drop_if_exported).result():
+            # keep the late samples for the next export
+            self.write(
+                lambda cur: cur.execute(
+                    f"DELETE FROM {schema}.candidate_samples WHERE id <= ?", (max_id,)
+                ),
+                [day],
+            ).result()
+
+    def _drop_partitions(self, conn, cutoff):
+        expired = [d for d in self.partitions.days() if d < cutoff]
+        if expired:
+            self.partitions.detach_except(conn)
+        for day in expired:
+            self.partitions.drop(day)
+        return expired
+
+    def _compact(self, conn):
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")  # main and attached partitions
+        # past days are no longer written to; only today's partition stays attached
+        self.partitions.detach_except(conn, keep=[day_of(None)])
+
+        if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] == 2:  # incremental
+            conn.execute("PRAGMA incremental_vacuum;")
+            return
+
+        free = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count;").fetchone()[0]
+        if pages and free / pages >= VACUUM_FREE_RATIO:
+            # one full rewrite switches the file to incremental vacuuming
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            conn.execute("VACUUM;")
+            # VACUUM may renumber the rowids steps_fts points at
+            conn.execute("INSERT INTO steps_fts(steps_fts) VALUES ('rebuild');")
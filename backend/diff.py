@@ -0,0 +1,179 @@
+"""
+Run comparison for /query/diff.
+
+Steps of the two runs are aligned by (step_name, occurrence), so a step
+that runs twice in a run pairs with its second run in the other. Paired
+steps get a recursive diff of their input, output, metrics (thresholds
+included), context and reasoning as a list of dotted-path changes, and a
+set comparison of their candidate samples: ids only in one run, ids whose
+decision changed, and per-rejection_reason counts that differ.
+"""
+import json
+from collections import Counter
+
+from .partitions import MAX_ATTACHED, day_of, schema_name
+from .runs import run_document
+
+DEFAULT_SAMPLE_IDS = 100
+
+# step column -> name used in change paths
+STEP_FIELDS = {
+    "step_type": "step_type",
+    "input_summary": "input",
+    "output_summary": "output",
+    "metrics_json": "metrics",
+    "context_json": "context",
+    "reasoning": "reasoning",
+}
+
+RUN_FIELDS = {
+    "input_summary": "input",
+    "outcome_summary": "outcome",
+    "metadata_json": "metadata",
+}
+
+SAMPLES_SQL = """
+    SELECT step_id, candidate_id, decision, rejection_reason
+    FROM {schema}.candidate_samples
+    WHERE step_id IN (SELECT step_id FROM main.steps WHERE run_id IN (?1, ?2))
+"""
+
+
+def diff_values(a, b, path=""):
+    """Changes turning `a` into `b`, as [{"path", "a", "b"}] (lists of scalars as added/removed)."""
+    if a == b:
+        return []
+    if isinstance(a, dict) and isinstance(b, dict):
+        changes = []
+        for key in sorted(a.keys() | b.keys()):
+            changes += diff_values(a.get(key), b.get(key), f"{path}.{key}" if path else key)
+        return changes
+    if isinstance(a, list) and isinstance(b, list) and _scalars(a) and _scalars(b):
+        count_a, count_b = Counter(a), Counter(b)
+        added, removed = count_b - count_a, count_a - count_b
+        if added or removed:
+            return [
+                {
+                    "path": path,
+                    "added": sorted(added.elements(), key=str),
+                    "removed": sorted(removed.elements(), key=str),
+                }
+            ]
+        return [{"path": path, "a": a, "b": b}]  # same items, reordered
+    return [{"path": path, "a": a, "b": b}]
+
+
+def _scalars(values):
+    return all(not isinstance(v, (dict, list)) for v in values)
+
+
+def align_steps(steps_a, steps_b):
+    """[(step_a, step_b)] by (step_name, occurrence); None where a run has no such step."""
+    def keyed(steps):
+        seen = Counter()
+        out = {}
+        for step in steps:
+            out[(step["step_name"], seen[step["step_name"]])] = step
+            seen[step["step_name"]] += 1
+        return out
+
+    by_a, by_b = keyed(steps_a), keyed(steps_b)
+    keys = list(by_a) + [k for k in by_b if k not in by_a]
+    return [(k, by_a.get(k), by_b.get(k)) for k in keys]
+
+
+def run_samples(conn, partitions, a, b, days):
+    """{step_id: [(candidate_id, decision, rejection_reason)]} for both runs' steps."""
+    days = sorted(days)
+    by_step = {}
+    for i in range(0, len(days), MAX_ATTACHED):
+        attached = partitions.attach(conn, days[i:i + MAX_ATTACHED])
+        for day in attached:
+            for step_id, *sample in conn.execute(
+                SAMPLES_SQL.format(schema=schema_name(day)), (a, b)
+            ):
+                by_step.setdefault(step_id, []).append(tuple(sample))
+    return by_step
+
+
+def diff_samples(samples_a, samples_b, limit=DEFAULT_SAMPLE_IDS):
+    """Set differences of two steps' samples; id lists sorted and capped at `limit`."""
+    decisions_a = {c: d for c, d, _ in samples_a}
+    decisions_b = {c: d for c, d, _ in samples_b}
+    ids_a, ids_b = decisions_a.keys(), decisions_b.keys()
+    only_a, only_b, common = ids_a - ids_b, ids_b - ids_a, ids_a & ids_b
+    changed = sorted((c for c in common if decisions_a[c] != decisions_b[c]), key=str)
+
+    reasons_a = Counter(r for _, _, r in samples_a if r is not None)
+    reasons_b = Counter(r for _, _, r in samples_b if r is not None)
+    return {
+        "count_a": len(samples_a),
+        "count_b": len(samples_b),
+        "common": len(common),
+        "only_a": {"count": len(only_a), "ids": sorted(only_a, key=str)[:limit]},
+        "only_b": {"count": len(only_b), "ids": sorted(only_b, key=str)[:limit]},
+        "decision_changed": {
+            "count": len(changed),
+            "candidates": [
+                {"candidate_id": c, "a": decisions_a[c], "b": decisions_b[c]}
+                for c in changed[:limit]
+            ],
+        },
+        "rejection_reasons": {
+            r: {"a": reasons_a[r], "b": reasons_b[r]}
+            for r in sorted(reasons_a.keys() | reasons_b.keys())
+            if reasons_a[r] != reasons_b[r]
+        },
+    }
+
+
+def diff_runs(conn, partitions, a, b, samples_limit=DEFAULT_SAMPLE_IDS):
+    """The diff document of runs `a` and `b`; None if either run is unknown."""
+    docs = [json.loads(run_document(conn, partitions, run_id)[0]) for run_id in (a, b)]
+    if not all(doc["run"] for doc in docs):
+        return None
+    (run_a, steps_a), (run_b, steps_b) = ((d["run"], d["steps"]) for d in docs)
+
+    days = {day_of(s["created_at"]) for s in steps_a + steps_b}
+    samples = run_samples(conn, partitions, a, b, days)
+
+    steps = []
+    totals = Counter()
+    for (name, occurrence), step_a, step_b in align_steps(steps_a, steps_b):
+        entry = {
+            "step_name": name,
+            "occurrence": occurrence,
+            "a": step_a["step_id"] if step_a else None,
+            "b": step_b["step_id"] if step_b else None,
+        }
+        if step_a is None or step_b is None:
+            entry["status"] = "only_a" if step_b is None else "only_b"
+        else:
+            entry["changes"] = [
+                change
+                for column, field in STEP_FIELDS.items()
+                for change in diff_values(step_a[column], step_b[column], field)
+            ]
+            entry["samples"] = diff_samples(
+                samples.get(step_a["step_id"], []), samples.get(step_b["step_id"], []),
+                samples_limit,
+            )
+            differs = entry["changes"] or any(
+                entry["samples"][k]["count"] for k in ("only_a", "only_b", "decision_changed")
+            ) or entry["samples"]["rejection_reasons"]
+            entry["status"] = "changed" if differs else "same"
+        totals[entry["status"]] += 1
+        steps.append(entry)
+
+    return {
+        "a": {k: run_a[k] for k in ("run_id", "pipeline_name", "started_at", "ended_at")},
+        "b": {k: run_b[k] for k in ("run_id", "pipeline_name", "started_at", "ended_at")},
+        "same_pipeline": run_a["pipeline_name"] == run_b["pipeline_name"],
+        "changes": [
+            change
+            for column, field in RUN_FIELDS.items()
+            for change in diff_values(run_a[column], run_b[column], field)
+        ],
+        "summary": {s: totals[s] for s in ("same", "changed", "only_a", "only_b")},
+        "steps": steps,
+    }
@@ -0,0 +1,271 @@
+import json
+from itertools import repeat
+
+from .anomalies import record_step_stats
+from .latency import record_latencies
+from .partitions import MAX_ATTACHED, day_of, schema_name
+
+# Shared write path for the single-record and batch ingest endpoints.
+
+# Nested blobs arrive as JSON text (see models.RawJSON) and are stored
+# without a Python decode/encode round trip. SQLite checks them with
+# json_valid (malformed text is stored as '{}') and pulls the promoted
+# columns out with json_extract.
+
+
+def _blob(param):
+    return f"CASE WHEN json_valid({param}) THEN {param} ELSE '{{}}' END"
+
+
+def _promoted_number(key):
+    # only plain numbers are promoted; anything else stays in metrics_json only
+    return (
+        f"CASE WHEN json_type(metrics, '$.{key}') IN ('integer', 'real')"
+        f" THEN json_extract(metrics, '$.{key}') END"
+    )
+
+
+# start_run and end_run upsert the same row and may arrive in either order
+# (an SDK replaying its disk buffer), so each fills in only the fields it
+# carries: empty strings and '{}' never overwrite what the other one sent.
+RUN_UPSERT_SQL = f"""
+    INSERT INTO runs (
+        run_id, pipeline_name, input_summary,
+        outcome_summary, started_at, ended_at, metadata_json
+    )
+    VALUES (?1, ?2, {_blob("?3")}, {_blob("?4")}, ?5, ?6, {_blob("?7")})
+    ON CONFLICT(run_id) DO UPDATE SET
+        pipeline_name   = coalesce(nullif(excluded.pipeline_name, ''), runs.pipeline_name),
+        input_summary   = coalesce(nullif(excluded.input_summary, '{{}}'), runs.input_summary),
+        outcome_summary = coalesce(nullif(excluded.outcome_summary, '{{}}'), runs.outcome_summary),
+        started_at      = coalesce(nullif(excluded.started_at, ''), runs.started_at),
+        ended_at        = coalesce(excluded.ended_at, runs.ended_at),
+        metadata_json   = coalesce(nullif(excluded.metadata_json, '{{}}'), runs.metadata_json)
+"""
+
+STEP_INSERT_SQL = f"""
+    INSERT OR REPLACE INTO steps
+    (step_id, run_id, step_name, step_type,
+     input_summary, output_summary,
+     metrics_json, reasoning, context_json, created_at,
+     filtered_ratio, latency_ms, candidate_count, approved_count, failure_mode)
+    SELECT
+        step_id, run_id, step_name, step_type,
+        input_summary, output_summary,
+        metrics, reasoning, context, created_at,
+        -- promoted columns, indexed for SQL-side filtering
+        {_promoted_number("filtered_ratio")},
+        {_promoted_number("latency_ms")},
+        {_promoted_number("count")},
+        {_promoted_number("approved_count")},
+        CAST(json_extract(context, '$.failure_mode') AS TEXT)
+    FROM (
+        SELECT
+            ?1 AS step_id, ?2 AS run_id, ?3 AS step_name, ?4 AS step_type,
+            {_blob("?5")} AS input_summary, {_blob("?6")} AS output_summary,
+            {_blob("?7")} AS metrics, ?8 AS reasoning,
+            {_blob("?9")} AS context, ?10 AS created_at
+    )
+"""
+
+# samples go to their day's partition (see partitions.py); SCHEMA is filled in per day
+SAMPLE_INSERT_SQL = f"""
+    INSERT INTO SCHEMA.candidate_samples
+    (step_id, candidate_id, attributes_json, decision, score, rejection_reason)
+    VALUES (?1, ?2, {_blob("?3")}, ?4, ?5, ?6)
+"""
+
+SAMPLE_DELETE_CHUNK = 1000
+
+
+# Recomputes one run's rollup from its steps (idx_steps_run_created), so it
+# stays correct however often a step is re-sent. Runs whose start_run has
+# not arrived yet get their summary when it does.
+RUN_SUMMARY_SQL = """
+    INSERT OR REPLACE INTO run_summaries
+    (run_id, pipeline_name, started_at, ended_at, status,
+     step_count, total_latency_ms, max_latency_ms, first_failure_mode, duration_ms)
+    SELECT
+        run_id, pipeline_name, started_at, ended_at,
+        CASE
+            WHEN first_failure_mode IS NOT NULL THEN 'failed'
+            WHEN ended_at IS NOT NULL THEN 'completed'
+            ELSE 'running'
+        END,
+        step_count, total_latency_ms, max_latency_ms, first_failure_mode,
+        round((julianday(ended_at) - julianday(started_at)) * 86400000, 2)
+    FROM (
+        SELECT
+            r.run_id, r.pipeline_name, r.started_at, r.ended_at,
+            COUNT(s.step_id) AS step_count,
+            round(SUM(s.latency_ms), 3) AS total_latency_ms,
+            MAX(s.latency_ms) AS max_latency_ms,
+            (SELECT failure_mode FROM steps
+             WHERE run_id = r.run_id AND failure_mode IS NOT NULL
+             ORDER BY created_at, step_id LIMIT 1) AS first_failure_mode
+        FROM runs r
+        LEFT JOIN steps s ON s.run_id = r.run_id
+        WHERE r.run_id = ?
+        GROUP BY r.run_id
+    )
+"""
+
+
+def run_row(payload):
+    return (
+        payload.run_id,
+        payload.pipeline_name,
+        payload.input_summary,
+        payload.outcome_summary,
+        payload.started_at,
+        payload.ended_at,
+        payload.metadata,
+    )
+
+
+def step_row(payload):
+    return (
+        payload.step_id,
+        payload.run_id,
+        payload.step_name,
+        payload.step_type,
+        payload.input_summary,
+        payload.output_summary,
+        payload.metrics,
+        payload.reasoning,
+        payload.context,
+        payload.created_at,
+    )
+
+
+def _attributes(value):
+    # pre-encoded by the SDK, or an object from the samples upload / older clients
+    return value if isinstance(value, str) else json.dumps(value or {})
+
+
+def sample_row(step_id, s):
+    return (
+        step_id,
+        s.get("candidate_id"),
+        _attributes(s.get("attributes")),
+        s.get("decision"),
+        s.get("score"),
+        s.get("rejection_reason"),
+    )
+
+
+def sample_rows(payload):
+    for s in payload.samples or ():
+        yield sample_row(payload.step_id, s)
+
+
+def candidate_rows(payload):
+    c = payload.candidates
+    if c is None:
+        return
+    n = len(c.candidate_id)
+
+    attributes = (a or "{}" for a in c.attributes) if c.attributes else repeat("{}", n)
+    yield from zip(
+        repeat(payload.step_id, n),
+        c.candidate_id,
+        attributes,
+        c.decision or repeat(None, n),
+        c.score or repeat(None, n),
+        c.rejection_reason or repeat(None, n),
+    )
+
+
+def delete_samples(cur, step_ids, day):
+    # in chunks: one large DELETE leaves the samples_fts index slow to insert
+    # into (several times slower for the rest of the upload that follows)
+    schema = schema_name(day)
+    sql = (
+        f"DELETE FROM {schema}.candidate_samples WHERE id IN ("
+        f"SELECT id FROM {schema}.candidate_samples WHERE step_id = ? LIMIT {SAMPLE_DELETE_CHUNK})"
+    )
+    for step_id in step_ids:
+        while cur.execute(sql, (step_id,)).rowcount:
+            pass
+
+
+def write_samples(cur, rows, day):
+    cur.executemany(SAMPLE_INSERT_SQL.replace("SCHEMA", schema_name(day), 1), rows)
+
+
+def write_runs(cur, runs):
+    # executemany applies rows in order, so a start_run followed by its
+    # end_run upsert in the same batch behaves like two separate requests
+    cur.executemany(RUN_UPSERT_SQL, [run_row(r) for r in runs])
+
+
+def new_steps(cur, steps):
+    """The steps not stored yet (re-sent ones are replaced, not counted twice)."""
+    by_id = {s.step_id: s for s in steps}
+    ids = list(by_id)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        for (step_id,) in cur.execute(
+            f"SELECT step_id FROM steps WHERE step_id IN ({', '.join('?' * len(chunk))})", chunk
+        ):
+            del by_id[step_id]
+    return list(by_id.values())
+
+
+def write_steps(cur, steps):
+    fresh = new_steps(cur, steps)
+    resent = {s.step_id for s in steps} - {s.step_id for s in fresh}
+    cur.executemany(STEP_INSERT_SQL, [step_row(s) for s in steps])
+    record_latencies(cur, fresh)
+    record_step_stats(cur, fresh)
+
+    # delivery is at-least-once (retries, disk-buffer replay): a re-sent step
+    # replaces its samples instead of adding a second copy, and the last copy
+    # of a step sent twice in one batch wins, as it does for the step row
+    by_day = {}
+    for s in {s.step_id: s for s in steps}.values():
+        if s.samples or s.candidates:
+            by_day.setdefault(day_of(s.created_at), []).append(s)
+    for day, day_steps in by_day.items():
+        delete_samples(cur, [s.step_id for s in day_steps if s.step_id in resent], day)
+        write_samples(cur, [row for s in day_steps for row in sample_rows(s)], day)
+        write_samples(cur, [row for s in day_steps for row in candidate_rows(s)], day)
+
+
+def sample_days(steps):
+    """Partitions a write_steps call touches, to attach before the write."""
+    return {day_of(s.created_at) for s in steps if s.samples or s.candidates}
+
+
+def chunk_by_days(steps, max_days=MAX_ATTACHED):
+    """Split steps so no chunk writes samples to more than `max_days` partitions."""
+    by_day = {}
+    for s in steps:
+        key = day_of(s.created_at) if s.samples or s.candidates else None
+        by_day.setdefault(key, []).append(s)
+
+    chunk, days = [], set()
+    for day, day_steps in by_day.items():
+        if day is not None and len(days) == max_days:
+            yield chunk, days
+            chunk, days = [], set()
+        chunk.extend(day_steps)
+        if day is not None:
+            days.add(day)
+    yield chunk, days
+
+
+def step_day(cur, step_id):
+    row = cur.execute("SELECT created_at FROM steps WHERE step_id = ?", (step_id,)).fetchone()
+    return day_of(row[0] if row else None)
+
+
+def refresh_run_summaries(cur, run_ids):
+    cur.executemany(RUN_SUMMARY_SQL, [(run_id,) for run_id in run_ids])
+
+
+def write_records(cur, runs=(), steps=()):
+    """Runs, then steps, then the summaries of every run they touched."""
+    write_runs(cur, runs)
+    write_steps(cur, steps)
+    refresh_run_summaries(cur, {r.run_id for r in runs} | {s.run_id for s in steps})
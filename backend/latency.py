@@ -0,0 +1,77 @@
+"""
+Step latency histograms for /query/latency.
+
+Every newly ingested step with a metrics.latency_ms is counted into
+latency_histograms under (minute, pipeline, step_name, step_type) and a
+log-scale bin: bin b holds latencies in (GROWTH**(b-1), GROWTH**b] ms.
+A percentile read back from the bins is within GROWTH**0.5 (about 2.5%)
+of the exact value, and a window query sums bins instead of scanning
+steps.
+"""
+import math
+
+GROWTH = 1.05
+MIN_LATENCY_MS = 0.001  # anything faster shares the lowest bin
+
+PERCENTILES = {"p50": 0.50, "p95": 0.95, "p99": 0.99}
+
+# pipeline_name: what the SDK sent, else the run's (already written by write_records)
+LATENCY_SQL = """
+    INSERT INTO latency_histograms
+    (minute, pipeline_name, step_name, step_type, bin, count)
+    SELECT
+        substr(s.created_at, 1, 16),
+        coalesce(nullif(?1, ''), (SELECT pipeline_name FROM runs WHERE run_id = s.run_id), ''),
+        s.step_name, s.step_type, latency_bin(s.latency_ms), 1
+    FROM steps s
+    WHERE s.step_id = ?2 AND s.latency_ms IS NOT NULL
+    ON CONFLICT (minute, pipeline_name, step_name, step_type, bin)
+    DO UPDATE SET count = count + 1
+"""
+
+BACKFILL_SQL = """
+    INSERT INTO latency_histograms
+    (minute, pipeline_name, step_name, step_type, bin, count)
+    SELECT
+        substr(s.created_at, 1, 16), coalesce(r.pipeline_name, ''),
+        s.step_name, s.step_type, latency_bin(s.latency_ms), COUNT(*)
+    FROM steps s
+    LEFT JOIN runs r ON r.run_id = s.run_id
+    WHERE s.latency_ms IS NOT NULL AND s.step_name IS NOT NULL AND s.step_type IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+def latency_bin(ms):
+    return math.ceil(math.log(max(ms, MIN_LATENCY_MS), GROWTH))
+
+
+def register(conn):
+    """Make latency_bin() available to SQL on `conn`."""
+    conn.create_function("latency_bin", 1, latency_bin, deterministic=True)
+
+
+def backfill(conn):
+    register(conn)
+    conn.execute(BACKFILL_SQL)
+
+
+def record_latencies(cur, steps):
+    cur.executemany(LATENCY_SQL, [(s.pipeline_name, s.step_id) for s in steps])
+
+
+def percentiles(bins):
+    """p50/p95/p99 in ms from {bin: count}; each is its bin's geometric midpoint."""
+    total = sum(bins.values())
+    result = {"count": total}
+    ordered = sorted(bins.items())
+    for name, q in PERCENTILES.items():
+        rank, seen = q * total, 0
+        for b, count in ordered:
+            seen += count
+            if seen >= rank:
+                result[name] = round(GROWTH ** (b - 0.5), 3)
+                break
+        else:
+            result[name] = None
+    return result
@@ -1,15 +1,48 @@
-from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
+from pydantic import BaseModel, BeforeValidator, model_validator
+from typing import Annotated, Optional, Dict, Any, List, Literal
+import json
+
+
+def _raw_json(value):
+    # nested blobs are only stored, never inspected, so they stay JSON text:
+    # the SDK sends them pre-encoded and they are written as-is (see
+    # ingest.py). Objects from older clients are encoded once here.
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return json.dumps(value)
+    raise ValueError("expected a JSON object or JSON text")
+
+
+RawJSON = Annotated[Optional[str], BeforeValidator(_raw_json)]
 
 
 class RunIngestRequest(BaseModel):
     run_id: str
     pipeline_name: str
-    input_summary: Optional[Dict[str, Any]] = None
-    outcome_summary: Optional[Dict[str, Any]] = None
+    input_summary: RawJSON = None
+    outcome_summary: RawJSON = None
     started_at: str
     ended_at: Optional[str] = None
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: RawJSON = None
+
+
+class CandidateColumns(BaseModel):
+    # columnar candidates from StepLogger.log_candidates: parallel lists
+    candidate_id: List[Any]
+    score: Optional[List[Optional[float]]] = None
+    decision: Optional[List[Optional[str]]] = None
+    rejection_reason: Optional[List[Optional[str]]] = None
+    attributes: Optional[List[RawJSON]] = None
+
+    @model_validator(mode="after")
+    def check_lengths(self):
+        n = len(self.candidate_id)
+        for name in ("score", "decision", "rejection_reason", "attributes"):
+            values = getattr(self, name)
+            if values is not None and len(values) != n:
+                raise ValueError(f"candidates.{name} has {len(values)} values, expected {n}")
+        return self
 
 
 class StepIngestRequest(BaseModel):
@@ -17,10 +50,23 @@ class StepIngestRequest(BaseModel):
     run_id: str
     step_name: str
     step_type: str
-    input_summary: Optional[Dict[str, Any]] = None
-    output_summary: Optional[Dict[str, Any]] = None
-    metrics: Optional[Dict[str, Any]] = None
+    input_summary: RawJSON = None
+    output_summary: RawJSON = None
+    metrics: RawJSON = None
     reasoning: Optional[str] = None
-    context: Optional[Dict[str, Any]] = None
+    context: RawJSON = None
     created_at: str
     samples: Optional[List[Dict[str, Any]]] = None
+    candidates: Optional[CandidateColumns] = None
+    # denormalized for rollups; empty means "look it up from the run"
+    pipeline_name: Optional[str] = None
+
+
+class BatchItem(BaseModel):
+    # payload is validated per item so one bad record doesn't fail the batch
+    type: Literal["run", "step"]
+    payload: Dict[str, Any]
+
+
+class BatchIngestRequest(BaseModel):
+    items: List[BatchItem]
@@ -0,0 +1,85 @@
+import asyncio
+import base64
+import json
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(*key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str, size=2):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        key = None
+    if not isinstance(key, list) or len(key) != size:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return key
+
+
+async def paginate(
+    db,
+    select_sql,
+    conditions=(),
+    params=(),
+    after=None,
+    limit=None,
+    format="json",
+    key=("steps.created_at", "steps.step_id"),
+    descending=False,
+):
+    """
+    Keyset pagination over `select_sql` ordered by `key` (newest first
+    with descending=True).
+
+    The selected rows must expose the key columns under their bare names
+    (e.g. `created_at`, `step_id`) so the next cursor can be built from the
+    last row. format="json" returns (rows, next_cursor); format="ndjson"
+    returns a StreamingResponse that reads rows off the cursor as they are
+    sent, unbounded unless `limit` is given.
+    """
+    conditions = list(conditions)
+    params = list(params)
+
+    if after:
+        placeholders = ", ".join("?" * len(key))
+        op = "<" if descending else ">"
+        conditions.append(f"({', '.join(key)}) {op} ({placeholders})")
+        params.extend(decode_cursor(after, len(key)))
+
+    sql = select_sql
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY " + ", ".join(f"{k} DESC" if descending else k for k in key)
+
+    if format == "ndjson":
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return StreamingResponse(
+            _stream(db, sql, params), media_type="application/x-ndjson"
+        )
+
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    rows = await asyncio.wrap_future(
+        db.read(lambda conn: conn.execute(sql + " LIMIT ?", [*params, limit + 1]).fetchall())
+    )
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(*(last[k.split(".")[-1]] for k in key))
+
+    return [dict(r) for r in rows], next_cursor
+
+
+async def _stream(db, sql, params):
+    async for rows in db.iter_rows(sql, params):
+        yield "".join(json.dumps(dict(row)) + "\n" for row in rows)
@@ -0,0 +1,167 @@
+"""
+Day partitions for candidate_samples.
+
+Samples are by far the fastest-growing data, so each day's samples live in
+their own SQLite file (`<partition dir>/samples-YYYY-MM-DD.db`), attached
+to a connection on demand as schema `p_YYYYMMDD`. A sample belongs to the
+day of its step's created_at. Retention removes a day by deleting its
+file instead of DELETE-ing rows.
+"""
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+# SQLite allows 10 attached databases by default; keep a couple spare
+MAX_ATTACHED = int(os.environ.get("XRAY_DB_MAX_ATTACHED", 8))
+
+DAY = re.compile(r"\d{4}-\d{2}-\d{2}$")
+FILE = re.compile(r"samples-(\d{4}-\d{2}-\d{2})\.db$")
+
+PARTITION_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.candidate_samples (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        step_id TEXT,
+        candidate_id TEXT,
+        attributes_json TEXT,
+        decision TEXT,
+        score REAL,
+        rejection_reason TEXT
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_samples_step ON candidate_samples(step_id);",
+    # full-text index over candidate ids and attributes (samples are only ever
+    # inserted or deleted, so two triggers keep it in sync)
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.samples_fts USING fts5(
+        candidate_id, attributes_json, content='candidate_samples', content_rowid='id'
+    );
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.samples_fts_insert AFTER INSERT ON candidate_samples BEGIN
+        INSERT INTO samples_fts(rowid, candidate_id, attributes_json)
+        VALUES (new.id, new.candidate_id, new.attributes_json);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.samples_fts_delete AFTER DELETE ON candidate_samples BEGIN
+        INSERT INTO samples_fts(samples_fts, rowid, candidate_id, attributes_json)
+        VALUES ('delete', old.id, old.candidate_id, old.attributes_json);
+    END;
+    """,
+]
+
+
+def day_of(created_at):
+    """Partition day of a step's created_at; unparseable timestamps land on today."""
+    day = (created_at or "")[:10]
+    if DAY.match(day):
+        return day
+    return datetime.utcnow().date().isoformat()
+
+
+def schema_name(day):
+    return "p_" + day.replace("-", "")
+
+
+class Partitions:
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, day):
+        return self.root / f"samples-{day}.db"
+
+    def days(self):
+        """Days that have a partition file, oldest first."""
+        if not self.root.is_dir():
+            return []
+        return sorted(m.group(1) for f in self.root.iterdir() if (m := FILE.match(f.name)))
+
+    def attach(self, conn, days, create=False):
+        """
+        Make each day in `days` available on `conn` as schema_name(day).
+        Must run outside a transaction. Days without a file are skipped
+        unless `create`; returns the days that are attached.
+        """
+        days = sorted(set(days))
+        if len(days) > MAX_ATTACHED:
+            raise ValueError(f"{len(days)} partitions requested, at most {MAX_ATTACHED} can be attached")
+
+        attached = attached_partitions(conn)
+        wanted = {schema_name(d) for d in days}
+
+        # drop attachments whose file retention has deleted, then make room
+        for name, file in list(attached.items()):
+            if not Path(file).exists():
+                self._detach(conn, name, attached)
+        missing = [d for d in days if schema_name(d) not in attached]
+        idle = sorted(n for n in attached if n not in wanted)
+        while idle and len(attached) + len(missing) > MAX_ATTACHED:
+            self._detach(conn, idle.pop(0), attached)
+
+        present = [d for d in days if schema_name(d) in attached]
+        for day in missing:
+            path = self.path(day)
+            if not create and not path.exists():
+                continue
+            self._attach(conn, day, path, create)
+            present.append(day)
+        return sorted(present)
+
+    def detach_except(self, conn, keep=()):
+        keep = {schema_name(d) for d in keep}
+        attached = attached_partitions(conn)
+        for name in list(attached):
+            if name not in keep:
+                self._detach(conn, name, attached)
+
+    def drop(self, day):
+        """Delete a day's partition file (callers detach it from the writer first)."""
+        path = self.path(day)
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(f"{path}{suffix}")
+            except OSError:
+                pass
+
+    def _attach(self, conn, day, path, create):
+        schema = schema_name(day)
+        if create:
+            self.root.mkdir(parents=True, exist_ok=True)
+            conn.execute("ATTACH DATABASE ? AS " + schema, (str(path),))
+            conn.execute(f"PRAGMA {schema}.journal_mode=WAL;")
+            indexed = conn.execute(
+                f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'samples_fts'"
+            ).fetchone()
+            for statement in PARTITION_SCHEMA:
+                conn.execute(statement.format(schema=schema))
+            if not indexed:
+                # partition written before samples_fts existed
+                conn.execute(f"INSERT INTO {schema}.samples_fts(samples_fts) VALUES ('rebuild')")
+        else:
+            # read connections are opened as URIs, so this stays read-only
+            conn.execute("ATTACH DATABASE ? AS " + schema, (f"{path.resolve().as_uri()}?mode=ro",))
+
+    @staticmethod
+    def _detach(conn, name, attached):
+        conn.execute("DETACH DATABASE " + name)
+        del attached[name]
+
+
+def attached_partitions(conn):
+    return {
+        name: file
+        for _, name, file in conn.execute("PRAGMA database_list")
+        if name.startswith("p_")
+    }
+
+
+def samples_source(days):
+    """FROM-clause source over the samples of the given (attached) days."""
+    if not days:
+        # no partitions: an empty relation with the same columns
+        return "(SELECT * FROM main.candidate_samples WHERE 0)"
+    return "(" + " UNION ALL ".join(
+        f"SELECT * FROM {schema_name(d)}.candidate_samples" for d in days
+    ) + ")"
@@ -0,0 +1,57 @@
+import os
+
+# Retention for the main database. Sample partitions expire by deleting
+# their file (see Database.run_maintenance); runs and steps are deleted in
+# bounded batches so each write job holds the writer only briefly.
+
+RETENTION_DAYS = int(os.environ.get("XRAY_RETENTION_DAYS", 0))  # 0 keeps everything
+RETENTION_BATCH = int(os.environ.get("XRAY_RETENTION_BATCH", 5000))
+
+EXPIRED_STEPS_SQL = """
+    DELETE FROM steps WHERE step_id IN (
+        SELECT step_id FROM steps WHERE created_at < ? ORDER BY created_at LIMIT ?
+    )
+"""
+
+EXPIRED_RUNS_SQL = """
+    SELECT run_id FROM run_summaries WHERE started_at < ? ORDER BY started_at LIMIT ?
+"""
+
+
+EXPIRED_LATENCY_SQL = """
+    DELETE FROM latency_histograms WHERE (minute, pipeline_name, step_name, step_type, bin) IN (
+        SELECT minute, pipeline_name, step_name, step_type, bin FROM latency_histograms
+        WHERE minute < ? ORDER BY minute LIMIT ?
+    )
+"""
+
+
+EXPIRED_ANOMALIES_SQL = """
+    DELETE FROM step_anomalies WHERE (step_id, metric) IN (
+        SELECT step_id, metric FROM step_anomalies WHERE created_at < ? ORDER BY created_at LIMIT ?
+    )
+"""
+
+
+def delete_expired(cur, cutoff, batch=RETENTION_BATCH):
+    """
+    Delete up to `batch` expired steps, runs, histogram and anomaly rows;
+    returns rows deleted. step_stats are running totals and stay.
+    """
+    deleted = cur.execute(EXPIRED_STEPS_SQL, (cutoff, batch)).rowcount
+    deleted += cur.execute(EXPIRED_LATENCY_SQL, (cutoff, batch)).rowcount
+    deleted += cur.execute(EXPIRED_ANOMALIES_SQL, (cutoff, batch)).rowcount
+
+    run_ids = [r[0] for r in cur.execute(EXPIRED_RUNS_SQL, (cutoff, batch))]
+    delete_runs(cur, run_ids)
+    return deleted + len(run_ids)
+
+
+def delete_steps(cur, step_ids):
+    cur.executemany("DELETE FROM steps WHERE step_id = ?", [(s,) for s in step_ids])
+
+
+def delete_runs(cur, run_ids):
+    params = [(r,) for r in run_ids]
+    cur.executemany("DELETE FROM run_summaries WHERE run_id = ?", params)
+    cur.executemany("DELETE FROM runs WHERE run_id = ?", params)
@@ -0,0 +1,103 @@
+"""
+The /query/run/{run_id} document, built as JSON text by SQLite.
+
+The run and its steps are read with json_object(), with the JSON blob
+columns (input_summary, metrics_json, ...) embedded decoded, so the
+response is spliced together from SQLite's output without a Python
+decode/encode round trip. With samples, a second query per group of
+day partitions fetches each step's samples (optionally the first
+`limit` per step) as one JSON array per step_id.
+"""
+import hashlib
+
+from .partitions import MAX_ATTACHED, day_of, schema_name
+
+# columns holding JSON text, embedded as JSON in the document
+JSON_COLUMNS = {
+    "input_summary",
+    "output_summary",
+    "outcome_summary",
+    "metrics_json",
+    "context_json",
+    "metadata_json",
+    "attributes_json",
+}
+
+_columns = {}
+
+
+def json_object_sql(conn, table, alias):
+    """json_object(...) over every column of `table`, JSON columns decoded."""
+    if table not in _columns:
+        _columns[table] = [r[1] for r in conn.execute(f"PRAGMA main.table_info({table})")]
+
+    pairs = []
+    for name in _columns[table]:
+        value = f"{alias}.{name}"
+        if name in JSON_COLUMNS:
+            value = f"CASE WHEN json_valid({value}) THEN json({value}) END"
+        pairs.append(f"'{name}', {value}")
+    return f"json_object({', '.join(pairs)})"
+
+
+def run_document(conn, partitions, run_id, samples=False, samples_limit=None):
+    """(JSON text of the run with its steps and their samples, the run's ended_at or None)."""
+    run = conn.execute(
+        f"SELECT {json_object_sql(conn, 'runs', 'r')}, r.ended_at FROM runs r WHERE r.run_id = ?",
+        (run_id,),
+    ).fetchone()
+    steps = conn.execute(
+        f"""
+        SELECT s.step_id, s.created_at, {json_object_sql(conn, 'steps', 's')}
+        FROM steps s WHERE s.run_id = ? ORDER BY s.created_at, s.step_id
+        """,
+        (run_id,),
+    ).fetchall()
+
+    parts = [step[2] for step in steps]
+    if samples:
+        days = {day_of(step[1]) for step in steps}
+        by_step = step_samples(conn, partitions, run_id, days, samples_limit)
+        # every json_object() ends with "}": add the samples as a last member
+        parts = [
+            f'{part[:-1]},"samples":{by_step.get(step[0], "[]")}}}'
+            for part, step in zip(parts, steps)
+        ]
+
+    body = f'{{"run":{run[0] if run else "null"},"steps":[{",".join(parts)}]}}'
+    return body, run[1] if run else None
+
+
+def step_samples(conn, partitions, run_id, days, limit=None):
+    """{step_id: JSON array of samples} for the run's steps in the given days."""
+    days = sorted(days)
+    sample = json_object_sql(conn, "candidate_samples", "c")
+    by_step = {}
+    for i in range(0, len(days), MAX_ATTACHED):
+        attached = partitions.attach(conn, days[i:i + MAX_ATTACHED])
+        if not attached:
+            continue
+        # ROW_NUMBER caps each step at `limit` samples, in insertion order
+        union = " UNION ALL ".join(
+            f"""
+            SELECT c.step_id, c.id, {sample} AS sample,
+                   ROW_NUMBER() OVER (PARTITION BY c.step_id ORDER BY c.id) AS n
+            FROM {schema_name(day)}.candidate_samples c
+            WHERE c.step_id IN (SELECT step_id FROM main.steps WHERE run_id = ?1)
+            """
+            for day in attached
+        )
+        rows = conn.execute(
+            f"""
+            SELECT step_id, json_group_array(json(sample)) FROM (
+                SELECT * FROM ({union}) WHERE ?2 IS NULL OR n <= ?2 ORDER BY step_id, id
+            ) GROUP BY step_id
+            """,
+            (run_id, limit),
+        )
+        by_step.update(rows.fetchall())
+    return by_step
+
+
+def etag(body):
+    return '"' + hashlib.blake2b(body.encode(), digest_size=16).hexdigest() + '"'
@@ -0,0 +1,77 @@
+"""
+Full-text search over step reasoning / output_summary (steps_fts, db.py
+migration 7) and candidate ids / attributes (each sample partition's
+samples_fts, partitions.py).
+
+`q` is an FTS5 query: bare words are ANDed, "quoted phrases", prefix*,
+OR / NOT, `column:term`. Results come best match first (bm25 rank) and are
+paginated with a (rank, key) cursor, so a page costs one ranked FTS lookup
+instead of an OFFSET scan.
+"""
+import sqlite3
+
+from fastapi import HTTPException
+
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from .partitions import schema_name
+
+# what SQLite reports for a malformed MATCH expression
+QUERY_ERRORS = ("fts5:", "no such column", "unterminated string", "unknown special query")
+
+# CROSS JOIN keeps the FTS table as the outer loop: matches drive the lookups
+STEP_SEARCH_SQL = """
+    SELECT * FROM (
+        SELECT s.step_id, s.run_id, s.step_name, s.step_type, s.created_at,
+               snippet(steps_fts, -1, '[', ']', '...', 12) AS snippet,
+               steps_fts.rank AS rank
+        FROM steps_fts
+        CROSS JOIN steps s ON s.rowid = steps_fts.rowid
+        WHERE steps_fts MATCH ?
+    )
+"""
+
+SAMPLE_SEARCH_SQL = """
+    SELECT '{day}' AS day, s.id, s.step_id, s.candidate_id, s.attributes_json,
+           s.decision, s.score, s.rejection_reason,
+           snippet(samples_fts, -1, '[', ']', '...', 12) AS snippet,
+           samples_fts.rank AS rank
+    FROM {schema}.samples_fts
+    CROSS JOIN {schema}.candidate_samples s ON s.id = samples_fts.rowid
+    WHERE samples_fts MATCH ?
+"""
+
+
+def search_steps(conn, q, after=None, limit=None):
+    return _page(conn, STEP_SEARCH_SQL, [q], ("rank", "step_id"), after, limit)
+
+
+def search_samples(conn, days, q, after=None, limit=None):
+    """Samples of the given (attached) days; bm25 is scored per day file."""
+    if not days:
+        return [], None
+    sql = "SELECT * FROM (" + " UNION ALL ".join(
+        SAMPLE_SEARCH_SQL.format(day=d, schema=schema_name(d)) for d in days
+    ) + ")"
+    return _page(conn, sql, [q] * len(days), ("rank", "day", "id"), after, limit)
+
+
+def _page(conn, sql, params, key, after, limit):
+    params = list(params)
+    if after:
+        sql += f" WHERE ({', '.join(key)}) > ({', '.join('?' * len(key))})"
+        params.extend(decode_cursor(after, len(key)))
+
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    sql += f" ORDER BY {', '.join(key)} LIMIT ?"
+    try:
+        rows = conn.execute(sql, [*params, limit + 1]).fetchall()
+    except sqlite3.OperationalError as e:
+        if str(e).startswith(QUERY_ERRORS):
+            raise HTTPException(status_code=400, detail=f"invalid search query: {e}")
+        raise
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*(rows[-1][k] for k in key))
+    return [dict(r) for r in rows], next_cursor
@@ -0,0 +1,146 @@
+"""
+Per-request CPU of the step ingest path: nested blobs validated as dicts and
+re-serialized (the previous models) vs. envelope-only validation with the
+blobs kept as JSON text (models.RawJSON).
+
+For each path, times what the request thread does (JSON body parse, pydantic
+validation, building the insert row) and, separately, the writer's
+executemany into an in-memory database at the latest schema.
+
+    python benchmarks/ingest_validation.py --steps 5000 --samples 10
+"""
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.db import migrate, SCHEMA_VERSION  # noqa: E402
+from backend.ingest import STEP_INSERT_SQL, step_row  # noqa: E402
+from backend.models import StepIngestRequest  # noqa: E402
+from benchmarks.wire_format import step_payload  # noqa: E402
+
+
+class DictStepIngestRequest(BaseModel):
+    # the model as it was before RawJSON
+    step_id: str
+    run_id: str
+    step_name: str
+    step_type: str
+    input_summary: Optional[Dict[str, Any]] = None
+    output_summary: Optional[Dict[str, Any]] = None
+    metrics: Optional[Dict[str, Any]] = None
+    reasoning: Optional[str] = None
+    context: Optional[Dict[str, Any]] = None
+    created_at: str
+    samples: Optional[List[Dict[str, Any]]] = None
+
+
+DICT_INSERT_SQL = """
+    INSERT OR REPLACE INTO steps
+    (step_id, run_id, step_name, step_type,
+     input_summary, output_summary,
+     metrics_json, reasoning, context_json, created_at,
+     filtered_ratio, latency_ms, candidate_count, approved_count, failure_mode)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def dict_step_row(payload):
+    metrics = payload.metrics or {}
+    failure_mode = (payload.context or {}).get("failure_mode")
+    return (
+        payload.step_id, payload.run_id, payload.step_name, payload.step_type,
+        json.dumps(payload.input_summary or {}),
+        json.dumps(payload.output_summary or {}),
+        json.dumps(payload.metrics or {}),
+        payload.reasoning,
+        json.dumps(payload.context or {}),
+        payload.created_at,
+        _number(metrics.get("filtered_ratio")),
+        _number(metrics.get("latency_ms")),
+        _number(metrics.get("count")),
+        _number(metrics.get("approved_count")),
+        None if failure_mode is None else str(failure_mode),
+    )
+
+
+def rich_payload(i, n_samples):
+    # summaries and context the size a real ranking step reports
+    p = step_payload(n_samples)
+    p["step_id"] = f"S{i:08d}"
+    p["input_summary"] = {"query": "adjustable phone stand", "candidates": [f"C{k}" for k in range(50)]}
+    p["output_summary"] = {
+        "kept": [{"id": f"C{k}", "score": k / 50, "title": f"Phone Stand {k}"} for k in range(20)]
+    }
+    p["context"] = {
+        "capture_mode": "sample",
+        "thresholds": {"price": [5, 80], "rating": 3.5, "reviews": 100},
+        "sampling": {"strategy": "stratified", "seen": 500, "kept": n_samples},
+    }
+    return p
+
+
+def pre_encoded(p):
+    # what the SDK sends now: nested blobs as JSON text
+    return {
+        **p,
+        **{k: json.dumps(p[k], separators=(",", ":"))
+           for k in ("input_summary", "output_summary", "metrics", "context")},
+        "samples": [{**s, "attributes": json.dumps(s["attributes"])} for s in p["samples"]],
+    }
+
+
+def run(label, bodies, model, to_row, sql):
+    t0 = time.process_time()
+    rows = [to_row(model.model_validate(json.loads(b))) for b in bodies]
+    request_cpu = time.process_time() - t0
+
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    migrate(conn, SCHEMA_VERSION)
+    t0 = time.process_time()
+    conn.execute("BEGIN")
+    conn.executemany(sql, rows)
+    conn.execute("COMMIT")
+    write_cpu = time.process_time() - t0
+    conn.close()
+
+    n = len(bodies)
+    print(
+        f"{label:<14}{request_cpu / n * 1e6:>14.1f}{write_cpu / n * 1e6:>12.1f}"
+        f"{(request_cpu + write_cpu) / n * 1e6:>10.1f}"
+    )
+    return request_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=5000)
+    parser.add_argument("--samples", type=int, default=10)
+    args = parser.parse_args()
+
+    payloads = [rich_payload(i, args.samples) for i in range(args.steps)]
+    dict_bodies = [json.dumps(p) for p in payloads]
+    raw_bodies = [json.dumps(pre_encoded(p)) for p in payloads]
+
+    print(f"{args.steps} steps x {args.samples} samples, CPU us per step\n")
+    print(f"{'path':<14}{'request':>14}{'writer':>12}{'total':>10}")
+    before = run("dict", dict_bodies, DictStepIngestRequest, dict_step_row, DICT_INSERT_SQL)
+    after = run("raw json", raw_bodies, StepIngestRequest, step_row, STEP_INSERT_SQL)
+    print(f"\nrequest-thread CPU: {after / before:.2f}x of before")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Query latency before/after the secondary indexes (schema migration 2).
+
+Builds a throwaway database with --steps synthetic steps at schema version 1,
+times the hot /query/* statements, then migrates to the latest version and
+times them again.
+
+    python benchmarks/query_latency.py --steps 1000000
+"""
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.db import migrate, SCHEMA_VERSION  # noqa: E402
+
+STEP_TYPES = ["llm", "retrieval", "filter", "validation", "rank"]
+PIPELINES = ["competitor_match_pipeline", "competitor_match_pipeline_failure_demo"]
+
+
+def populate(conn, n_steps, samples_per_step):
+    n_runs = n_steps // len(STEP_TYPES)
+    runs, steps, samples = [], [], []
+
+    for r in range(n_runs):
+        run_id = str(uuid.uuid4())
+        started = f"2026-01-01T00:00:{r:012d}"
+        runs.append((run_id, random.choice(PIPELINES), "{}", "{}", started, started, "{}"))
+
+        for i, step_type in enumerate(STEP_TYPES):
+            step_id = str(uuid.uuid4())
+            ctx = {"failure_mode": "llm_keyword_drift"} if random.random() < 0.05 else {}
+            metrics = {"filtered_ratio": round(random.random(), 3), "latency_ms": 1.0}
+            steps.append(
+                (step_id, run_id, f"step_{i}", step_type, "{}", "{}",
+                 json.dumps(metrics), None, json.dumps(ctx), f"{started}.{i}")
+            )
+            for k in range(samples_per_step):
+                samples.append((step_id, f"C{k}", "{}", "kept", 0.5, None))
+
+        if len(steps) >= 50_000:
+            flush(conn, runs, steps, samples)
+
+    flush(conn, runs, steps, samples)
+    return runs
+
+
+def flush(conn, runs, steps, samples):
+    conn.executemany("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)", runs)
+    conn.executemany("INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", steps)
+    conn.executemany(
+        "INSERT INTO candidate_samples (step_id, candidate_id, attributes_json,"
+        " decision, score, rejection_reason) VALUES (?, ?, ?, ?, ?, ?)",
+        samples,
+    )
+    conn.commit()
+    runs.clear()
+    steps.clear()
+    samples.clear()
+
+
+def queries(conn, run_ids):
+    run_id = random.choice(run_ids)
+    step_id = conn.execute(
+        "SELECT step_id FROM steps WHERE run_id = ? LIMIT 1", (run_id,)
+    ).fetchone()[0]
+
+    return {
+        "get_run steps": (
+            "SELECT * FROM steps WHERE run_id = ? ORDER BY created_at", (run_id,)
+        ),
+        "filter steps": (
+            "SELECT count(*) FROM steps WHERE step_type = 'filter'", ()
+        ),
+        "samples for step": (
+            "SELECT * FROM candidate_samples WHERE step_id = ?", (step_id,)
+        ),
+        "runs by pipeline": (
+            "SELECT * FROM runs WHERE pipeline_name = ? ORDER BY started_at DESC LIMIT 20",
+            (PIPELINES[0],),
+        ),
+    }
+
+
+def time_queries(conn, run_ids, repeat):
+    timings = {}
+    for _ in range(repeat):
+        for name, (sql, params) in queries(conn, run_ids).items():
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+    return {name: sorted(t)[len(t) // 2] for name, t in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=1_000_000)
+    parser.add_argument("--samples-per-step", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    path = Path(tempfile.mkdtemp()) / "bench.db"
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=OFF;")
+    migrate(conn, target=1)
+
+    print(f"populating {args.steps:,} steps ...")
+    populate(conn, args.steps, args.samples_per_step)
+    run_ids = [r[0] for r in conn.execute("SELECT run_id FROM runs")]
+
+    before = time_queries(conn, run_ids, args.repeat)
+
+    start = time.perf_counter()
+    migrate(conn, target=SCHEMA_VERSION)
+    migrate_s = time.perf_counter() - start
+
+    after = time_queries(conn, run_ids, args.repeat)
+
+    print(f"migration to v{SCHEMA_VERSION}: {migrate_s:.1f}s")
+    print(f"{'query':<20}{'before ms':>12}{'after ms':>12}")
+    for name in before:
+        print(f"{name:<20}{before[name]:>12.2f}{after[name]:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
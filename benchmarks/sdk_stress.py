@@ -0,0 +1,125 @@
+"""
+Concurrency stress check for the SDK batch exporter.
+
+Starts the backend on a throwaway database, then drives --threads threads
+and --processes forked worker processes that all share one XRay client
+created in the parent. Every step logs one sample; afterwards the script
+checks that each expected step arrived exactly once.
+
+    python benchmarks/sdk_stress.py --threads 32 --steps 200 --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+DB_PATH = Path(tempfile.mkdtemp()) / "stress.db"
+os.environ["XRAY_DB_PATH"] = str(DB_PATH)
+
+import uvicorn  # noqa: E402
+
+from backend.app import app, db  # noqa: E402
+from backend.partitions import samples_source, schema_name  # noqa: E402
+from sdk.xray import XRay  # noqa: E402
+
+xray = None
+run_id = None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_backend(port):
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def work(worker, n_steps):
+    for i in range(n_steps):
+        with xray.step(run_id, f"{worker}-{i}", "stress") as s:
+            s.log_sample(f"{worker}-{i}")
+    return n_steps
+
+
+def process_work(args):
+    worker, n_steps = args
+    work(worker, n_steps)
+    xray.flush(30)
+    return n_steps
+
+
+def main():
+    global xray, run_id
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=200, help="steps per worker")
+    args = parser.parse_args()
+
+    port = free_port()
+    server, server_thread = start_backend(port)
+
+    xray = XRay(f"http://127.0.0.1:{port}", exporter="batch", overflow="block")
+    run_id = xray.start_run("sdk_stress")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        list(pool.map(work, [f"t{i}" for i in range(args.threads)], [args.steps] * args.threads))
+
+    if args.processes and hasattr(os, "fork"):
+        ctx = multiprocessing.get_context("fork")
+        pool = ctx.Pool(args.processes)
+        pool.map(process_work, [(f"p{i}", args.steps) for i in range(args.processes)])
+        pool.close()
+        pool.join()
+
+    xray.end_run(run_id)
+    xray.flush(60)
+    elapsed = time.perf_counter() - start
+    # ingest is acknowledged once queued; shutdown drains the writer
+    server.should_exit = True
+    server_thread.join()
+
+    expected = {f"t{i}-{k}" for i in range(args.threads) for k in range(args.steps)}
+    if args.processes and hasattr(os, "fork"):
+        expected |= {f"p{i}-{k}" for i in range(args.processes) for k in range(args.steps)}
+
+    conn = sqlite3.connect(DB_PATH)
+    names = [r[0] for r in conn.execute("SELECT step_name FROM steps WHERE run_id = ?", (run_id,))]
+    # samples live in per-day partition files
+    days = db.partitions.days()
+    for day in days:
+        conn.execute(f"ATTACH DATABASE ? AS {schema_name(day)}", (str(db.partitions.path(day)),))
+    samples = conn.execute(
+        f"SELECT candidate_id, COUNT(*) FROM {samples_source(days)} GROUP BY candidate_id"
+    ).fetchall()
+
+    lost = expected - set(names)
+    duplicated = [c for c, n in samples if n > 1]
+
+    print(f"steps expected: {len(expected):,}  stored: {len(names):,}  in {elapsed:.2f}s")
+    print(f"lost: {len(lost)}  duplicated: {len(duplicated)}  dropped: {xray.transport.exporter.dropped}")
+    sys.exit(1 if lost or duplicated or len(samples) != len(expected) else 0)
+
+
+if __name__ == "__main__":
+    main()
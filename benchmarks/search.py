@@ -0,0 +1,99 @@
+"""
+Full-text step search: FTS5 (steps_fts, schema migration 7) vs. a LIKE scan.
+
+Builds a throwaway database with --steps synthetic steps, 1% of which
+mention `semantic_drift` in their reasoning, then times the first and a
+later page of /query/search against the LIKE scan it replaces.
+
+    python benchmarks/search.py --steps 1000000
+"""
+import argparse
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.db import migrate  # noqa: E402
+from backend.search import search_steps  # noqa: E402
+
+WORDS = (
+    "filtered candidates by price rating reviews kept rejected threshold keyword "
+    "match relevance score llm retrieval ranked stand laptop phone monitor"
+).split()
+
+
+def reasoning(i):
+    words = random.choices(WORDS, k=12)
+    if i % 100 == 0:
+        words[random.randrange(12)] = "semantic_drift"
+    return " ".join(words)
+
+
+def populate(conn, n_steps):
+    batch = []
+    for i in range(n_steps):
+        batch.append(
+            (f"S{i:09d}", f"R{i // 5:09d}", "apply_filters", "filter", reasoning(i),
+             '{"kept": 20}', f"2026-01-01T00:00:{i:012d}")
+        )
+        if len(batch) == 50_000:
+            flush(conn, batch)
+    flush(conn, batch)
+
+
+def flush(conn, batch):
+    conn.executemany(
+        "INSERT INTO steps (step_id, run_id, step_name, step_type, reasoning,"
+        " output_summary, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        batch,
+    )
+    conn.commit()
+    batch.clear()
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2], result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(7)
+    conn = sqlite3.connect(Path(tempfile.mkdtemp()) / "bench.db")
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=OFF;")
+    migrate(conn)
+
+    print(f"populating {args.steps:,} steps ...")
+    populate(conn, args.steps)
+
+    like_ms, _ = timed(
+        lambda: conn.execute(
+            "SELECT step_id FROM steps WHERE reasoning LIKE '%semantic_drift%'"
+        ).fetchall(),
+        args.repeat,
+    )
+    first_ms, (_, cursor) = timed(lambda: search_steps(conn, "semantic_drift"), args.repeat)
+    next_ms, _ = timed(lambda: search_steps(conn, "semantic_drift", after=cursor), args.repeat)
+
+    print(f"{'query':<28}{'ms':>10}")
+    print(f"{'LIKE scan (unranked)':<28}{like_ms:>10.2f}")
+    print(f"{'FTS5 ranked, page 1':<28}{first_ms:>10.2f}")
+    print(f"{'FTS5 ranked, page 2':<28}{next_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
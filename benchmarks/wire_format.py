@@ -0,0 +1,127 @@
+"""
+Ingest wire formats: bytes on the wire and server CPU per ingested step.
+
+Encodes --steps synthetic step payloads (shaped like the demo pipeline's
+filter step, --samples candidates each) with every encoding/compression
+the installed libraries allow, then times what the backend does with each
+body before it reaches the database: decompress, decode (through
+CodecRequest) and pydantic validation.
+
+    python benchmarks/wire_format.py --steps 2000 --samples 50
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.codec import CodecRequest  # noqa: E402
+from backend.models import StepIngestRequest  # noqa: E402
+from sdk.codec import Codec, msgpack, zstandard  # noqa: E402
+
+REASONS = ["price_out_of_range", "low_rating", "insufficient_reviews", None]
+TITLES = ["Phone Stand", "Laptop Stand", "Tablet Holder", "Monitor Arm", "Desk Mount"]
+
+
+def step_payload(n_samples):
+    samples = []
+    for i in range(n_samples):
+        reason = random.choice(REASONS)
+        samples.append(
+            {
+                "candidate_id": f"C{i:05d}",
+                "attributes": {
+                    "title": f"{random.choice(TITLES)} {i}",
+                    "price": round(random.uniform(5, 80), 2),
+                    "rating": round(random.uniform(2.5, 5), 1),
+                    "reviews": random.randint(0, 5000),
+                },
+                "score": round(random.random(), 4),
+                "decision": "rejected" if reason else "kept",
+                "rejection_reason": reason,
+            }
+        )
+    return {
+        "step_id": str(uuid.uuid4()),
+        "run_id": str(uuid.uuid4()),
+        "step_name": "apply_filters",
+        "step_type": "filter",
+        "input_summary": {"candidate_count": n_samples},
+        "output_summary": {"kept": n_samples // 4},
+        "metrics": {"filtered_ratio": 0.75, "latency_ms": 12.5, "count": n_samples},
+        "reasoning": "Filtered by price, rating and review count",
+        "context": {"capture_mode": "sample"},
+        "samples": samples,
+        "pipeline_name": "competitor_match_pipeline",
+        "created_at": "2026-01-01T00:00:00",
+    }
+
+
+def server_decode(loop, body, headers):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/ingest/step",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def decode():
+        return await CodecRequest(scope, receive).json()
+
+    return StepIngestRequest.model_validate(loop.run_until_complete(decode()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(7)
+    payloads = [step_payload(args.samples) for _ in range(args.steps)]
+
+    formats = [("json", None), ("json", "gzip")]
+    if zstandard is not None:
+        formats.append(("json", "zstd"))
+    if msgpack is not None:
+        formats += [("msgpack", None), ("msgpack", "gzip")]
+        if zstandard is not None:
+            formats.append(("msgpack", "zstd"))
+    if msgpack is None or zstandard is None:
+        print("msgpack / zstandard not installed: those formats are skipped\n")
+
+    print(f"{args.steps} steps x {args.samples} samples\n")
+    print(f"{'format':<16}{'bytes/step':>12}{'ratio':>8}{'client us':>12}{'server us':>12}")
+
+    loop = asyncio.new_event_loop()
+    baseline = None
+    for encoding, compression in formats:
+        codec = Codec(encoding, compression)
+
+        t0 = time.process_time()
+        bodies = [codec.encode(p) for p in payloads]
+        encode_cpu = time.process_time() - t0
+
+        t0 = time.process_time()
+        for body, headers in bodies:
+            server_decode(loop, body, headers)
+        decode_cpu = time.process_time() - t0
+
+        size = sum(len(b) for b, _ in bodies) / len(bodies)
+        baseline = baseline or size
+        name = encoding + (f"+{compression}" if compression else "")
+        print(
+            f"{name:<16}{size:>12,.0f}{size / baseline:>8.2f}"
+            f"{encode_cpu / args.steps * 1e6:>12.0f}{decode_cpu / args.steps * 1e6:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
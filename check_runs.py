@@ -1,10 +1,13 @@
 from backend.db import get_conn
 
 conn = get_conn()
-rows = conn.execute("SELECT run_id, pipeline_name FROM runs ORDER BY rowid DESC LIMIT 10").fetchall()
+rows = conn.execute(
+    "SELECT run_id, pipeline_name, status, step_count FROM run_summaries"
+    " ORDER BY started_at DESC, run_id DESC LIMIT 10"
+).fetchall()
 
 for r in rows:
-    print(r["run_id"], r["pipeline_name"])
+    print(r["run_id"], r["pipeline_name"], r["status"], r["step_count"])
 
 from sdk.xray import XRay
 print("SDK OK")
@@ -217,7 +217,8 @@ def run_pipeline(product):
             "product_price": product["price"],
             "candidate_count": len(candidates),
         },
-        max_samples=25,
+        max_samples=40,
+        sample_strategy="stratified",  # every rejection reason gets samples
     ) as s:
 
         filtered, rejected, breakdown, thresholds = filter_candidates(
@@ -255,10 +256,10 @@ def run_pipeline(product):
             f"kept {len(filtered)} / {len(candidates)} candidates"
         )
 
-        for c, reason in rejected[:25]:
+        for c, reason in rejected:
             s.log_sample(c["id"], attributes=c, rejection_reason=reason)
 
-        for c, reason in filtered[:15]:
+        for c, reason in filtered:
             s.log_sample(c["id"], attributes=c, decision=reason)
 
     # ---------- STEP 4 ----------
@@ -267,6 +268,8 @@ def run_pipeline(product):
         "llm_relevance_check",
         "validation",
         input_summary={"post_filter_count": len(filtered)},
+        max_samples=15,
+        sample_strategy="top_k",
     ) as s:
 
         approved = validate_relevance(filtered)
@@ -279,7 +282,7 @@ def run_pipeline(product):
             "LLM relevance scoring applied — candidates kept only if rel_score >= 0.50"
         )
 
-        for c in approved[:15]:
+        for c in approved:
             s.log_sample(
                 c["id"], attributes=c, score=c["rel_score"], decision="approved"
             )
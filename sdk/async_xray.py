@@ -0,0 +1,76 @@
+from .transport import AsyncXRayTransport, SpoolFile
+from .xray import XRayBase
+from contextlib import asynccontextmanager
+import time
+
+
+class AsyncXRay(XRayBase):
+    """
+    XRay for pipelines running inside an event loop. Payloads are queued
+    for a background task, so instrumented coroutines never await network
+    I/O; call `await xray.aclose()` (or use `async with`) to drain it.
+    """
+
+    def __init__(self, api_url: str, capture_mode="sample", **exporter_options):
+        super().__init__(capture_mode)
+        self.transport = AsyncXRayTransport(api_url, **exporter_options)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    # --------- RUN LEVEL ---------
+    async def start_run(
+        self, pipeline_name: str, input_summary=None, metadata=None, capture_mode=None
+    ):
+        payload = self._start_run_payload(
+            pipeline_name, input_summary, metadata, capture_mode
+        )
+        await self.transport.submit("/ingest/run", payload)
+        return payload["run_id"]
+
+    async def end_run(self, run_id: str, outcome_summary=None):
+        payload = self._end_run_payload(run_id, outcome_summary)
+        await self.transport.submit("/ingest/run", payload)
+
+    async def flush(self):
+        return await self.transport.flush()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    # --------- STEP LEVEL ---------
+    @asynccontextmanager
+    async def step(
+        self,
+        run_id,
+        step_name,
+        step_type,
+        input_summary=None,
+        max_samples=50,
+        sample_strategy="head",
+        capture_mode=None,
+    ):
+        start = time.time()
+        logger = self._open_step(
+            run_id,
+            step_name,
+            step_type,
+            input_summary,
+            max_samples,
+            sample_strategy,
+            capture_mode,
+        )
+
+        try:
+            yield logger
+        finally:
+            payload, spool_path = self._close_step(logger, start)
+            await self.transport.submit("/ingest/step", payload)
+
+            if spool_path:
+                await self.transport.submit(
+                    f"/ingest/samples/{payload['step_id']}", SpoolFile(spool_path)
+                )
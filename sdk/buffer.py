@@ -0,0 +1,215 @@
+import hashlib
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+
+from .spool import SpoolFile, discard
+
+DEFAULT_ROOT = Path(tempfile.gettempdir()) / "xray-buffer"
+
+# buffer directories are named <pid>-<n>, n counting the buffers of one process
+BUFFER_DIR = re.compile(r"(\d+)-\d+$")
+_instances = itertools.count()
+
+
+class DiskBuffer:
+    """
+    Bounded on-disk write-ahead buffer for batches the backend could not
+    take. Batches are appended as JSON lines to segment files under
+    `<root>/<backend>/<pid>-<n>/`, where <backend> is a hash of `api_url`
+    and <n> numbers the buffers of one process, so no two transports
+    share segments. Replay reads the oldest segment front to back and
+    deletes it once every line has been acknowledged.
+
+    Segments left behind for the same backend by a process that has since
+    died are adopted on startup, so buffered telemetry survives a restart.
+    When the buffer grows past `max_bytes` whole segments are dropped,
+    oldest first.
+    """
+
+    def __init__(
+        self,
+        root=None,
+        api_url="",
+        max_bytes=64 * 1024 * 1024,
+        segment_bytes=4 * 1024 * 1024,
+    ):
+        self.root = Path(root or DEFAULT_ROOT) / _backend_key(api_url)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.dropped_segments = 0
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self.dir = self.root / f"{os.getpid()}-{next(_instances)}"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._segments = sorted(self.dir.glob("seg-*.ndjson"))
+        self._seq = int(self._segments[-1].stem[4:]) + 1 if self._segments else 0
+        self._offset = 0  # byte offset of the next batch in the oldest segment
+        self._peeked = 0
+        self._head = None  # (segment, offset) of the batch peek() last returned
+        self._failures = 0  # failed deliveries of that batch
+        self._adopt_orphans()
+
+    def reopen(self):
+        """Start a fresh buffer directory in a forked child."""
+        # the parent's lock may have been held by a thread that doesn't exist
+        # in the child: replace it rather than wait on it
+        self._lock = threading.Lock()
+        self._open()
+
+    def _adopt_orphans(self):
+        for d in self.root.iterdir():
+            match = BUFFER_DIR.match(d.name)
+            if not d.is_dir() or not match or d == self.dir:
+                continue
+            if _alive(int(match.group(1))):
+                continue
+            for seg in sorted(d.glob("seg-*.ndjson")):
+                target = self._next_segment_path()
+                try:
+                    os.rename(seg, target)
+                except OSError:
+                    continue  # another process adopted it first
+                self._segments.append(target)
+            try:
+                d.rmdir()
+            except OSError:
+                pass
+        self._segments.sort()
+
+    def _next_segment_path(self):
+        path = self.dir / f"seg-{self._seq:012d}.ndjson"
+        self._seq += 1
+        return path
+
+    # --------- WRITE ---------
+    def append(self, batch):
+        line = json.dumps([_encode(path, payload) for path, payload in batch], default=str)
+
+        with self._lock:
+            if not self._segments or self._size(self._segments[-1]) >= self.segment_bytes:
+                self._segments.append(self._next_segment_path())
+            with open(self._segments[-1], "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._enforce_limit()
+
+    def _enforce_limit(self):
+        total = sum(self._size(s) for s in self._segments)
+        while total > self.max_bytes and len(self._segments) > 1:
+            seg = self._segments.pop(0)
+            total -= self._size(seg)
+            self._offset = 0
+            self._discard_segment(seg)
+            self.dropped_segments += 1
+
+    # --------- REPLAY ---------
+    def pending(self):
+        return bool(self._segments)
+
+    def peek(self):
+        """The oldest unacknowledged batch, or None."""
+        with self._lock:
+            while self._segments:
+                seg = self._segments[0]
+                try:
+                    with open(seg, "rb") as f:
+                        f.seek(self._offset)
+                        line = f.readline()
+                except FileNotFoundError:
+                    # removed behind our back (e.g. a cleaned-up tmp dir)
+                    self._segments.pop(0)
+                    self._offset = 0
+                    continue
+
+                if not line:
+                    # fully replayed
+                    self._segments.pop(0)
+                    self._offset = 0
+                    discard(seg)
+                    continue
+
+                try:
+                    batch = [_decode(item) for item in json.loads(line)]
+                except ValueError:
+                    # torn write from a crashed process: skip the line
+                    self._offset += len(line)
+                    continue
+
+                self._peeked = len(line)
+                if self._head != (seg, self._offset):
+                    self._head = (seg, self._offset)
+                    self._failures = 0
+                return batch
+            return None
+
+    def ack(self):
+        """Mark the batch returned by peek() as delivered."""
+        with self._lock:
+            if not self._segments:
+                return
+            self._offset += self._peeked
+            self._peeked = 0
+            self._failures = 0
+            if self._offset >= self._size(self._segments[0]):
+                discard(self._segments.pop(0))
+                self._offset = 0
+
+    def fail(self):
+        """Count a failed delivery of the batch returned by peek(); returns the count."""
+        with self._lock:
+            self._failures += 1
+            return self._failures
+
+    # --------- HELPERS ---------
+    @staticmethod
+    def _size(path):
+        try:
+            return path.stat().st_size
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _discard_segment(seg):
+        try:
+            with open(seg, "r", encoding="utf-8") as f:
+                for line in f:
+                    for item in json.loads(line):
+                        if "file" in item:
+                            discard(item["file"])
+        except (OSError, ValueError):
+            pass
+        discard(seg)
+
+
+def _backend_key(api_url):
+    return hashlib.sha1(api_url.rstrip("/").encode()).hexdigest()[:16]
+
+
+def _encode(path, payload):
+    if isinstance(payload, SpoolFile):
+        return {"path": path, "file": payload.path}
+    return {"path": path, "payload": payload}
+
+
+def _decode(item):
+    if "file" in item:
+        return item["path"], SpoolFile(item["file"])
+    return item["path"], item["payload"]
+
+
+def _alive(pid):
+    if os.name == "nt":
+        return True  # os.kill(pid, 0) terminates the process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
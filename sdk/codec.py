@@ -0,0 +1,68 @@
+import gzip
+import json
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+ENCODINGS = ("json", "msgpack")
+COMPRESSIONS = (None, "gzip", "zstd")
+
+# small bodies aren't worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+class Codec:
+    """
+    Encodes ingest request bodies: compact JSON or MessagePack, optionally
+    gzip or zstd compressed. Options whose library isn't installed fall
+    back (msgpack -> JSON, zstd -> gzip), and downgrade() drops to plain
+    JSON when the backend answers 415.
+    """
+
+    def __init__(self, encoding="json", compression=None):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"unknown encoding: {encoding!r}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression: {compression!r}")
+
+        if encoding == "msgpack" and msgpack is None:
+            encoding = "json"
+        if compression == "zstd" and zstandard is None:
+            compression = "gzip"
+
+        self.encoding = encoding
+        self.compression = compression
+
+    @property
+    def plain(self):
+        return self.encoding == "json" and self.compression is None
+
+    def downgrade(self):
+        self.encoding = "json"
+        self.compression = None
+
+    def encode(self, payload):
+        """Returns (body, headers)."""
+        if self.encoding == "msgpack":
+            body = msgpack.packb(payload, default=str, use_bin_type=True)
+            headers = {"Content-Type": "application/msgpack"}
+        else:
+            body = json.dumps(payload, default=str, separators=(",", ":")).encode()
+            headers = {"Content-Type": "application/json"}
+
+        if self.compression and len(body) >= MIN_COMPRESS_BYTES:
+            if self.compression == "zstd":
+                # compressors aren't safe to share between threads
+                body = zstandard.ZstdCompressor(level=3).compress(body)
+            else:
+                body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = self.compression
+
+        return body, headers
@@ -0,0 +1,222 @@
+import heapq
+import math
+import random
+
+# Bounded candidate samplers used by StepLogger. Each keeps at most `k`
+# samples no matter how many candidates are offered: one at a time by
+# log_sample (offer), or a call's worth of columns at once by
+# log_candidates (offer_rows, which builds `row(i)` only for rows it keeps).
+# Both feed the same selection, so the budget and the strategy span the step.
+
+
+class HeadSampler:
+    """Keeps the first `k` candidates."""
+
+    strategy = "head"
+
+    def __init__(self, k, rng=None):
+        self.k = k
+        self.seen = 0
+        self.items = []
+
+    def offer(self, sample):
+        self.seen += 1
+        if len(self.items) < self.k:
+            self.items.append(sample)
+
+    def offer_rows(self, n, row, scores=None, strata=None):
+        take = max(0, min(n, self.k - len(self.items)))
+        self.items.extend(row(i) for i in range(take))
+        self.seen += n
+
+    def samples(self):
+        return list(self.items)
+
+
+class ReservoirSampler:
+    """Uniform sample of `k` candidates over a stream of unknown length (Algorithm R)."""
+
+    strategy = "reservoir"
+
+    def __init__(self, k, rng=None):
+        self.k = k
+        self.rng = rng or random
+        self.seen = 0
+        self.items = []
+
+    def offer(self, sample):
+        self._put(self._slot(), sample)
+
+    def offer_rows(self, n, row, scores=None, strata=None):
+        i = 0
+        while i < n and len(self.items) < self.k:
+            self._put(self._slot(), row(i))
+            i += 1
+        # full: jump straight to the next row Algorithm R would take
+        while self.k:
+            skip = self._skip(n - i)
+            self.seen += skip
+            i += skip
+            if i >= n:
+                return
+            self.seen += 1
+            self.items[self.rng.randrange(self.k)] = row(i)
+            i += 1
+        self.seen += n - i
+
+    def _skip(self, limit):
+        """
+        How many candidates Algorithm R passes over before taking the next
+        one (at most `limit`), drawn in O(log) by inverting
+        P(skip >= s) = prod_{i=seen+1}^{seen+s} (1 - k/i).
+        """
+        t, k = self.seen, self.k
+        log_u = math.log(1.0 - self.rng.random())
+        base = math.lgamma(t - k + 1) - math.lgamma(t + 1)
+
+        def log_survival(s):
+            return math.lgamma(t + s - k + 1) - math.lgamma(t + s + 1) - base
+
+        if log_survival(limit) >= log_u:
+            return limit
+        lo, hi = 0, limit  # survival(lo) >= u > survival(hi)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if log_survival(mid) >= log_u:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    def _slot(self):
+        """Where the next candidate goes: an index into items, or None to skip it."""
+        self.seen += 1
+        if len(self.items) < self.k:
+            return len(self.items)
+        j = self.rng.randrange(self.seen)
+        return j if j < self.k else None
+
+    def _put(self, slot, sample):
+        if slot is None:
+            return
+        if slot == len(self.items):
+            self.items.append(sample)
+        else:
+            self.items[slot] = sample
+
+    def resize(self, k):
+        # a uniform subset of a uniform sample is still uniform
+        if len(self.items) > k:
+            self.items = self.rng.sample(self.items, k)
+        self.k = k
+
+    def samples(self):
+        return list(self.items)
+
+
+def decision_stratum(sample):
+    return (sample.get("decision"), sample.get("rejection_reason"))
+
+
+class StratifiedSampler:
+    """
+    One reservoir per stratum (by default each decision / rejection_reason
+    pair), with the `k` budget split evenly across the strata seen so far,
+    so rare rejection reasons are represented alongside common ones.
+    """
+
+    strategy = "stratified"
+
+    def __init__(self, k, rng=None, key=decision_stratum):
+        self.k = k
+        self.rng = rng or random
+        self.key = key
+        self.seen = 0
+        self.reservoirs = {}
+
+    def offer(self, sample):
+        self.seen += 1
+        reservoir = self._reservoir(self.key(sample))
+        if reservoir is not None:
+            reservoir.offer(sample)
+
+    def offer_rows(self, n, row, scores=None, strata=None):
+        groups = {}
+        for i in range(n):
+            groups.setdefault(strata[i] if strata else (None, None), []).append(i)
+        self.seen += n
+        # a later stratum shrinks the earlier reservoirs by uniform subsampling,
+        # so filling them group by group keeps each one uniform
+        for stratum, indices in groups.items():
+            reservoir = self._reservoir(stratum)
+            if reservoir is not None:
+                reservoir.offer_rows(len(indices), lambda j, ix=indices: row(ix[j]))
+
+    def _reservoir(self, stratum):
+        reservoir = self.reservoirs.get(stratum)
+        if reservoir is None:
+            if len(self.reservoirs) >= self.k:
+                return None  # more strata than budget: later strata go unsampled
+            reservoir = self.reservoirs[stratum] = ReservoirSampler(self.k, self.rng)
+            share, extra = divmod(self.k, len(self.reservoirs))
+            for i, r in enumerate(self.reservoirs.values()):
+                r.resize(share + (i < extra))
+        return reservoir
+
+    def samples(self):
+        return [s for r in self.reservoirs.values() for s in r.items]
+
+
+class TopKSampler:
+    """The `k` highest-scoring candidates, kept in a bounded min-heap."""
+
+    strategy = "top_k"
+
+    def __init__(self, k, rng=None):
+        self.k = k
+        self.seen = 0
+        self.heap = []
+
+    def offer(self, sample):
+        self.seen += 1
+        self._push(sample.get("score"), self.seen, sample)
+
+    def offer_rows(self, n, row, scores=None, strata=None):
+        # only a call's own k best can make the step's k best (ties: earliest first)
+        base = self.seen
+        self.seen += n
+        if scores is None:
+            best = range(min(n, self.k))
+        else:
+            low = float("-inf")
+            best = heapq.nlargest(
+                self.k, range(n), key=lambda i: low if scores[i] is None else scores[i]
+            )
+        for i in best:
+            self._push(None if scores is None else scores[i], base + i + 1, row(i))
+
+    def _push(self, score, seq, sample):
+        entry = (float("-inf") if score is None else score, -seq, sample)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def samples(self):
+        return [s for _, _, s in sorted(self.heap, reverse=True)]
+
+
+SAMPLERS = {
+    "head": HeadSampler,
+    "reservoir": ReservoirSampler,
+    "stratified": StratifiedSampler,
+    "top_k": TopKSampler,
+}
+
+
+def make_sampler(strategy, k, rng=None):
+    try:
+        return SAMPLERS[strategy](k, rng=rng)
+    except KeyError:
+        raise ValueError(f"unknown sample strategy: {strategy!r}") from None
+
@@ -0,0 +1,50 @@
+import gzip
+import json
+import os
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class SpoolWriter:
+    """
+    Spills every candidate of a full-capture step to a gzip-compressed
+    NDJSON file on local disk instead of holding them in memory.
+    """
+
+    def __init__(self, dir=None):
+        fd, self.path = tempfile.mkstemp(prefix="xray-", suffix=".ndjson.gz", dir=dir)
+        os.close(fd)
+        self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        self.count = 0
+
+    def write(self, sample):
+        self._file.write(json.dumps(sample, default=str))
+        self._file.write("\n")
+        self.count += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        return self.path
+
+
+class SpoolFile:
+    """Queue marker for a finished spool file waiting to be uploaded."""
+
+    def __init__(self, path):
+        self.path = path
+
+
+def iter_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yield the compressed spool file in chunks for a streamed upload."""
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
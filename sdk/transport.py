@@ -1,23 +1,811 @@
 import httpx
 import asyncio
+import atexit
+import collections
+import copy
+import itertools
+import os
+import random
+import threading
+import time
+import weakref
+
+from .buffer import DiskBuffer
+from .codec import Codec
+from .spool import SpoolFile, discard, iter_chunks
+
+# single-record endpoints that the backend also accepts through /ingest/batch
+BATCH_TYPES = {"/ingest/run": "run", "/ingest/step": "step"}
+
+# overloaded, restarting or behind a proxy that lost it: any batch may get these
+TRANSIENT_STATUSES = {502, 503, 504}
+
+# a buffered batch that keeps failing for reasons of its own (a 500 its
+# payload triggers, a payload the codec can't encode) is dropped after this
+# many replays instead of holding up everything queued behind it
+MAX_REPLAY_ATTEMPTS = 5
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing backend instead of hammering it.
+
+    closed: calls flow. After `failure_threshold` consecutive failures the
+    breaker opens and rejects calls for a backoff delay that doubles on
+    every re-open (with full jitter, capped at `max_delay`). Once the delay
+    passes it is half-open: a single probe call is let through, and its
+    outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=3, base_delay=0.5, max_delay=60.0):
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = "closed"  # closed | open | half_open
+        self.failures = 0
+        self.opened = 0  # consecutive re-opens, drives the backoff
+        self.retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if self.state == "closed":
+            return True
+        with self._lock:
+            if self.state == "open" and time.monotonic() >= self.retry_at:
+                self.state = "half_open"
+                return True  # this caller is the probe
+            return False
+
+    def record_success(self):
+        if self.state == "closed" and not self.failures:
+            return
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.opened = 0
+
+    def cancel(self):
+        """Hand back a probe that allow() granted but that made no call."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"  # retry_at has passed: the next allow() probes
+
+    def record_failure(self):
+        """Returns True if this failure tripped the breaker open."""
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                was_closed = self.state == "closed"
+                self.state = "open"
+                self.retry_at = time.monotonic() + backoff(
+                    self.opened, self.base_delay, self.max_delay
+                )
+                self.opened += 1
+                return was_closed
+            return False
+
+
+def backoff(attempt, base_delay, max_delay):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+class DeliveryError(Exception):
+    def __init__(self, status):
+        super().__init__(f"backend returned {status}")
+        self.status = status
+
+
+def check_response(response):
+    # 5xx and transport errors are worth retrying; 4xx means the payload
+    # itself is bad and resending it won't help
+    if response.status_code >= 500:
+        raise DeliveryError(response.status_code)
+    return response
+
+
+def transient(error):
+    """True for failures of the backend or the network rather than of the batch itself."""
+    if isinstance(error, DeliveryError):
+        return error.status in TRANSIENT_STATUSES
+    return isinstance(error, httpx.TransportError)
+
+
+# how often an idle exporter retries the disk buffer (the breaker's backoff
+# still decides whether a retry reaches the backend)
+IDLE_INTERVAL_S = 1.0
+
+# buffered batches a sync-mode call replays before its own: more than the
+# one it may add, so the buffer drains without stalling any single caller
+SYNC_REPLAY_LIMIT = 2
+
+# spool files are already gzip NDJSON; they are streamed as-is
+SPOOL_HEADERS = {"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+
+
+class Delivery:
+    """
+    Retries, circuit breaker and disk buffer, shared by both transports.
+
+    The logic is written once as coroutines over an I/O adapter that does
+    the actual posting, sleeping and disk access. SyncIO does all of it
+    inline, so the coroutines never suspend and `run_sync` drives them on
+    the caller's thread; AsyncIO awaits an httpx.AsyncClient and moves
+    disk work to a thread so the event loop never blocks on it.
+    """
+
+    def __init__(
+        self, io, api_url, query, codec, breaker, buffer, max_retries, retry_base_delay
+    ):
+        self.io = io
+        self.api_url = api_url
+        self.query = query
+        self.codec = codec
+        self.breaker = breaker
+        self.buffer = buffer
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self._replaying = threading.Lock()
+
+    async def send_batch(self, batch, replay_limit=None):
+        # buffered batches are older than this one, so they go first; while
+        # any are left this one queues behind them, or a replayed start_run
+        # could land after the end_run that followed it
+        if self.buffer.pending():
+            await self.replay(replay_limit)
+            if self.buffer.pending():
+                await self.spill(batch)
+                return
+
+        if not self.breaker.allow():
+            await self.spill(batch)
+            return
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.deliver(batch)
+            except Exception:
+                if self.breaker.record_failure():
+                    print("[XRAY] Backend unreachable — buffering to disk until it recovers")
+                if attempt == self.max_retries or not self.breaker.allow():
+                    await self.spill(batch)
+                    return
+                await self.io.sleep(backoff(attempt, self.retry_base_delay, 5.0))
+            else:
+                self.breaker.record_success()
+                return
+
+    async def spill(self, batch):
+        await self.io.disk(spill, self.buffer, batch)
+
+    async def replay(self, limit=None, timeout=0):
+        """
+        Deliver buffered batches, oldest first, until the buffer is empty,
+        the breaker stops calls or `limit` batches are sent. With the
+        default timeout=0 it returns at once if someone else is replaying;
+        otherwise it waits for them and gives up after `timeout` seconds
+        (None: no limit). Only SyncIO callers may wait.
+        """
+        if not self.buffer.pending():
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._replaying.acquire(timeout=-1 if timeout is None else timeout):
+            return  # someone else is replaying
+        try:
+            await self._replay_locked(limit, deadline if timeout else None)
+        except OSError as e:
+            # a buffer that can't be read must not fail the caller's pipeline
+            print(f"[XRAY] Could not replay the disk buffer: {e}")
+        finally:
+            self._replaying.release()
+
+    async def _replay_locked(self, limit, deadline):
+        replayed = 0
+        while self.buffer.pending() and (limit is None or replayed < limit):
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            if not self.breaker.allow():
+                return
+            batch = await self.io.disk(self.buffer.peek)
+            if batch is None:
+                self.breaker.cancel()  # or the breaker stays half-open for good
+                return
+            try:
+                await self.deliver(batch)
+            except Exception as e:
+                self.breaker.record_failure()
+                if not transient(e) and self.buffer.fail() >= MAX_REPLAY_ATTEMPTS:
+                    print(
+                        f"[XRAY] Dropping a buffered batch of {len(batch)} items that"
+                        f" failed {MAX_REPLAY_ATTEMPTS} replays: {e!r}"
+                    )
+                    await self.io.disk(self.buffer.ack)
+                    for _, file_path in split_batch(batch)[2]:
+                        await self.io.disk(discard, file_path)
+                return
+            self.breaker.record_success()
+            await self.io.disk(self.buffer.ack)
+            replayed += 1
+
+    async def deliver(self, batch):
+        records, others, files = split_batch(batch)
+
+        if records:
+            check_response(await self._post("/ingest/batch", {"items": records}))
+        for path, payload in others:
+            check_response(await self._post(path, payload))
+
+        # sample uploads go after the batch that carries their step
+        for path, file_path in files:
+            if await self.io.disk(os.path.exists, file_path):
+                check_response(await self.io.upload(self._url(path), file_path))
+            await self.io.disk(discard, file_path)
+
+    async def _post(self, path, payload):
+        body, headers = self.codec.encode(payload)
+        response = await self.io.post(self._url(path), body, headers)
+        if response.status_code == 415 and not self.codec.plain:
+            # the backend can't read this encoding: fall back to plain JSON
+            self.codec.downgrade()
+            return await self._post(path, payload)
+        return response
+
+    def _url(self, path):
+        return f"{self.api_url}{path}{self.query}"
+
+
+class SyncIO:
+    """Delivery I/O done inline on the calling thread."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def post(self, url, body, headers):
+        return self.client.post(url, content=body, headers=headers)
+
+    async def upload(self, url, file_path):
+        return self.client.post(
+            url, content=iter_chunks(file_path), timeout=30, headers=SPOOL_HEADERS
+        )
+
+    async def sleep(self, seconds):
+        time.sleep(seconds)
+
+    async def disk(self, fn, *args):
+        return fn(*args)
+
+
+class AsyncIO:
+    """Delivery I/O on the event loop; file access runs in a worker thread."""
+
+    def __init__(self, client=None):
+        self.client = client
+
+    async def post(self, url, body, headers):
+        return await self.client.post(url, content=body, headers=headers)
+
+    async def upload(self, url, file_path):
+        return await self.client.post(
+            url, content=_aiter_chunks(file_path), timeout=30, headers=SPOOL_HEADERS
+        )
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+    async def disk(self, fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+
+async def _aiter_chunks(path):
+    chunks = iter_chunks(path)
+    try:
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+    finally:
+        chunks.close()
+
+
+def run_sync(coro):
+    """Run a Delivery coroutine over SyncIO, where it never suspends, to completion."""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("delivery suspended outside an event loop")
 
 
 class XRayTransport:
-    def __init__(self, api_url: str):
+    """
+    Posts payloads to the backend, either inline (mode="sync") or from a
+    background BatchExporter (mode="batch").
+
+    Failed deliveries are retried with jittered exponential backoff (batch
+    mode only; sync mode never sleeps on the caller's thread) and then
+    written to a bounded on-disk buffer. A circuit breaker stops calls
+    while the backend is down, and buffered batches are replayed once it
+    accepts requests again, so a backend restart neither blocks the
+    pipeline nor loses runs.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        mode="sync",
+        max_batch_size=100,
+        linger_ms=50,
+        queue_size=10_000,
+        overflow="drop",
+        max_retries=3,
+        retry_base_delay=0.2,
+        failure_threshold=3,
+        breaker_max_delay=60.0,
+        buffer_dir=None,
+        buffer_max_bytes=64 * 1024 * 1024,
+        encoding="json",
+        compression=None,
+        durable=False,
+    ):
         self.api_url = api_url.rstrip("/")
-        self.enabled = True
+        self.mode = mode  # sync | batch
+        self.exporter = None
+
+        # one pooled keep-alive client; httpx.Client is safe to share
+        # between threads, so every caller reuses the same connections
+        self.client = httpx.Client(timeout=5)
+        self.delivery = Delivery(
+            SyncIO(self.client),
+            self.api_url,
+            # durable: the backend acknowledges after commit rather than after queueing
+            "?sync=true" if durable else "",
+            Codec(encoding, compression),  # json | msgpack, gzip | zstd
+            CircuitBreaker(
+                failure_threshold=failure_threshold,
+                base_delay=retry_base_delay,
+                max_delay=breaker_max_delay,
+            ),
+            DiskBuffer(buffer_dir, self.api_url, max_bytes=buffer_max_bytes),
+            max_retries if mode == "batch" else 0,
+            retry_base_delay,
+        )
+
+        if mode == "batch":
+            # batches go out as a single /ingest/batch request
+            self.exporter = BatchExporter(
+                self._send_batch,
+                max_batch_size=max_batch_size,
+                linger_ms=linger_ms,
+                queue_size=queue_size,
+                overflow=overflow,
+                idle=self._probe,
+            )
+        elif mode != "sync":
+            raise ValueError(f"unknown transport mode: {mode!r}")
+
+        _live_transports.add(self)
+
+    @property
+    def enabled(self):
+        return self.delivery.breaker.state != "open"
 
-    async def post(self, path: str, payload: dict):
-        if not self.enabled:
+    def post_sync(self, path: str, payload: dict):
+        if self.exporter is not None:
+            self.exporter.submit(path, payload)
+            return
+        self._send_batch([(path, payload)], replay_limit=SYNC_REPLAY_LIMIT)
+
+    def post_file(self, path: str, file_path: str):
+        """Upload a gzip NDJSON spool file as a streamed body, then delete it."""
+        if self.exporter is not None:
+            self.exporter.submit(path, SpoolFile(file_path))
+            return
+        self._send_batch(
+            [(path, SpoolFile(file_path))], replay_limit=SYNC_REPLAY_LIMIT
+        )
+
+    def flush(self, timeout=None):
+        """
+        Send everything submitted so far, then replay the disk buffer.
+        True once nothing is left undelivered, or the breaker is open and
+        the rest waits on disk for the backend to come back.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self.exporter is not None and not self.exporter.flush(timeout):
+            return False
+        if self.client is not None:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            run_sync(self.delivery.replay(timeout=remaining))
+        return not self.delivery.buffer.pending() or not self.enabled
+
+    def shutdown(self, timeout=5):
+        if self.exporter is not None:
+            self.exporter.shutdown(timeout)
+        if self.client is not None:
+            run_sync(self.delivery.replay(timeout=timeout))
+            self.client.close()
+            self.client = None
+
+    def _after_fork_in_child(self):
+        # the parent's sockets and worker thread don't survive fork: open a
+        # fresh client and leave the parent's connections untouched
+        old = self.delivery
+        self.client = httpx.Client(timeout=5)
+        old.buffer.reopen()
+        self.delivery = Delivery(
+            SyncIO(self.client),
+            old.api_url,
+            old.query,
+            old.codec,
+            CircuitBreaker(
+                failure_threshold=old.breaker.failure_threshold,
+                base_delay=old.breaker.base_delay,
+                max_delay=old.breaker.max_delay,
+            ),
+            old.buffer,
+            old.max_retries,
+            old.retry_base_delay,
+        )
+        if self.exporter is not None:
+            self.exporter._after_fork_in_child()
+
+    def _send_batch(self, batch, replay_limit=None):
+        if self.client is None:
+            return
+        run_sync(self.delivery.send_batch(batch, replay_limit))
+
+    def _probe(self):
+        # exporter idle: retry the buffer, or a process that has gone quiet
+        # would keep it until its next payload
+        if self.client is not None:
+            run_sync(self.delivery.replay())
+
+
+def spill(buffer, batch):
+    """Write an undeliverable batch to the disk buffer; if even that fails, drop it."""
+    try:
+        buffer.append(batch)
+    except OSError as e:
+        print(f"[XRAY] Could not write to the disk buffer, dropping {len(batch)} items: {e}")
+
+
+def split_batch(batch):
+    """Split queued (path, payload) items into /ingest/batch records, other posts and spool uploads."""
+    records, others, files = [], [], []
+    for path, payload in batch:
+        if isinstance(payload, SpoolFile):
+            files.append((path, payload.path))
+        elif path in BATCH_TYPES:
+            records.append({"type": BATCH_TYPES[path], "payload": payload})
+        else:
+            others.append((path, payload))
+    return records, others, files
+
+
+class BatchExporter:
+    """
+    Queues payloads in memory and hands them to `send` in batches from a
+    background worker, so instrumented code never waits on the network.
+
+    A batch is flushed once it holds `max_batch_size` items or its first
+    item has waited `linger_ms`. When the queue is full, `overflow="drop"`
+    discards the payload (counted in `dropped`) and `overflow="block"`
+    waits for room. `idle`, if given, is called whenever the worker has
+    had nothing to send for `idle_interval` seconds.
+
+    submit() may be called from any number of threads. The buffer is a
+    deque, whose append/popleft are atomic, so the hot path takes no lock
+    unless it has to wake the worker or wait for room.
+    """
+
+    def __init__(
+        self,
+        send,
+        max_batch_size=100,
+        linger_ms=50,
+        queue_size=10_000,
+        overflow="drop",
+        idle=None,
+        idle_interval=IDLE_INTERVAL_S,
+    ):
+        if overflow not in ("drop", "block"):
+            raise ValueError(f"unknown overflow policy: {overflow!r}")
+
+        self.send = send
+        self.idle = idle
+        self.idle_interval = idle_interval if idle is not None else None
+        self.max_batch_size = max_batch_size
+        self.linger = linger_ms / 1000
+        self.queue_size = queue_size
+        self.overflow = overflow
+
+        self._start()
+        atexit.register(self.shutdown)
+
+    def _start(self):
+        self.closed = False
+        self._buffer = collections.deque()
+        self._dropped = itertools.count()
+        self._pending = threading.Event()  # buffer is non-empty
+        self._urgent = threading.Event()  # flush now, skip the linger window
+        self._space = threading.Condition()
+        self._worker = threading.Thread(
+            target=self._run, name="xray-exporter", daemon=True
+        )
+        self._worker.start()
+
+    def _after_fork_in_child(self):
+        # payloads queued before the fork are the parent's to send; the child
+        # starts empty so nothing is exported twice
+        self._start()
+        _exit_hook(self.shutdown)
+
+    @property
+    def dropped(self):
+        # itertools.count has no peek; read the next value from a copy
+        return next(copy.copy(self._dropped))
+
+    def submit(self, path: str, payload):
+        if self.closed:
+            return False
+
+        if len(self._buffer) >= self.queue_size:
+            if self.overflow == "drop":
+                next(self._dropped)
+                return False
+            with self._space:
+                while len(self._buffer) >= self.queue_size and not self.closed:
+                    self._space.wait(0.1)
+
+        self._buffer.append((path, payload))
+        if not self._pending.is_set():
+            self._pending.set()
+        if len(self._buffer) >= self.max_batch_size and not self._urgent.is_set():
+            self._urgent.set()
+        return True
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been handed to `send`."""
+        if self.closed:
+            return True
+
+        done = threading.Event()
+        self._buffer.append(done)
+        self._urgent.set()
+        self._pending.set()
+        return done.wait(timeout)
+
+    def shutdown(self, timeout=5):
+        if self.closed:
+            return
+        self.closed = True
+        self._urgent.set()
+        self._pending.set()
+        self._worker.join(timeout)
+
+    # --------- WORKER ---------
+    def _run(self):
+        while True:
+            if not self._pending.wait(self.idle_interval):
+                try:
+                    self.idle()
+                except Exception:
+                    pass
+                continue
+            self._pending.clear()
+
+            # give the batch up to `linger` to fill, unless asked to hurry
+            if not self.closed:
+                self._urgent.wait(self.linger)
+            self._urgent.clear()
+
+            self._drain()
+
+            if self.closed and not self._buffer:
+                return
+
+    def _drain(self):
+        while self._buffer:
+            batch = []
+            marker = None
+            while self._buffer and len(batch) < self.max_batch_size:
+                item = self._buffer.popleft()
+                if isinstance(item, threading.Event):
+                    marker = item  # send what came before it, then signal
+                    break
+                batch.append(item)
+
+            if batch:
+                try:
+                    self.send(batch)
+                except Exception:
+                    pass
+
+            if marker is not None:
+                marker.set()
+
+            if self.overflow == "block":
+                with self._space:
+                    self._space.notify_all()
+
+
+# --------- FORK SAFETY ---------
+_live_transports = weakref.WeakSet()
+
+
+def _reinit_after_fork():
+    for transport in list(_live_transports):
+        transport._after_fork_in_child()
+
+
+def _exit_hook(fn):
+    # multiprocessing children leave through os._exit, which skips atexit;
+    # their exit path does run multiprocessing finalizers
+    try:
+        from multiprocessing import util
+    except ImportError:
+        return
+    util.Finalize(None, fn, exitpriority=10)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
+class AsyncXRayTransport:
+    """
+    asyncio counterpart of the batch exporter: payloads go onto an
+    asyncio.Queue and a background task ships them over one long-lived
+    httpx.AsyncClient. Started lazily on the running loop by the first
+    submit(). Retries, the circuit breaker and the disk buffer are the
+    same Delivery core XRayTransport uses.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        api_url: str,
+        max_batch_size=100,
+        linger_ms=50,
+        queue_size=10_000,
+        overflow="drop",
+        max_retries=3,
+        retry_base_delay=0.2,
+        failure_threshold=3,
+        breaker_max_delay=60.0,
+        buffer_dir=None,
+        buffer_max_bytes=64 * 1024 * 1024,
+        encoding="json",
+        compression=None,
+        durable=False,
+    ):
+        if overflow not in ("drop", "block"):
+            raise ValueError(f"unknown overflow policy: {overflow!r}")
+
+        self.api_url = api_url.rstrip("/")
+        self.delivery = Delivery(
+            AsyncIO(),  # the client is opened on the loop by _ensure_started
+            self.api_url,
+            # durable: the backend acknowledges after commit rather than after queueing
+            "?sync=true" if durable else "",
+            Codec(encoding, compression),  # json | msgpack, gzip | zstd
+            CircuitBreaker(
+                failure_threshold=failure_threshold,
+                base_delay=retry_base_delay,
+                max_delay=breaker_max_delay,
+            ),
+            DiskBuffer(buffer_dir, self.api_url, max_bytes=buffer_max_bytes),
+            max_retries,
+            retry_base_delay,
+        )
+        self.max_batch_size = max_batch_size
+        self.linger = linger_ms / 1000
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.dropped = 0
+        self.client = None
+        self.queue = None
+        self.task = None
+
+    def _ensure_started(self):
+        if self.task is None:
+            self.client = self.delivery.io.client = httpx.AsyncClient(timeout=5)
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, path: str, payload):
+        self._ensure_started()
+        try:
+            if self.overflow == "block":
+                await self.queue.put((path, payload))
+            else:
+                self.queue.put_nowait((path, payload))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    async def flush(self):
+        """
+        Send everything submitted so far, then replay the disk buffer.
+        True once nothing is left undelivered, or the breaker is open and
+        the rest waits on disk for the backend to come back.
+        """
+        if self.task is not None:
+            done = asyncio.Event()
+            await self.queue.put(done)
+            await done.wait()
+        return not self.delivery.buffer.pending() or not self.enabled
+
+    async def aclose(self):
+        if self.task is None:
             return
+        await self.queue.put(self._STOP)
+        await self.task
+        await self.client.aclose()
+        self.task = None
 
+    @property
+    def enabled(self):
+        return self.delivery.breaker.state != "open"
+
+    # --------- WORKER ---------
+    async def _probe(self):
         try:
-            async with httpx.AsyncClient(timeout=5) as client:
-                await client.post(f"{self.api_url}{path}", json=payload)
-        except Exception:
-            # Fail-safe mode: never break the pipeline
-            self.enabled = False
-            print("[XRAY] Backend unreachable — switching to no-op mode")
+            await self.delivery.replay()
+        except Exception as e:
+            print(f"[XRAY] Could not replay the disk buffer: {e!r}")
 
-    def post_sync(self, path: str, payload: dict):
-        asyncio.run(self.post(path, payload))
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = []
+            markers = []
+            stop = False
+
+            if self.delivery.buffer.pending():
+                # retry the buffer now and then, or a quiet process would
+                # keep it until its next payload
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), IDLE_INTERVAL_S)
+                except asyncio.TimeoutError:
+                    await self._probe()
+                    continue
+            else:
+                item = await self.queue.get()
+            deadline = loop.time() + self.linger
+
+            while True:
+                if item is self._STOP:
+                    stop = True
+                elif isinstance(item, asyncio.Event):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+
+                if stop or markers or len(batch) >= self.max_batch_size:
+                    break
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                if batch:
+                    await self.delivery.send_batch(batch)
+                if markers or stop:
+                    # flush() and aclose() cover the disk buffer too
+                    await self.delivery.replay()
+            except Exception as e:
+                # like BatchExporter._drain: a failed batch must not end the worker
+                print(f"[XRAY] Dropped a batch of {len(batch)} items: {e!r}")
+            finally:
+                for m in markers:
+                    m.set()
+
+            if stop:
+                return
@@ -1,3 +1,4 @@
+import json
 import uuid
 from datetime import datetime
 
@@ -8,3 +9,9 @@ def new_id() -> str:
 
 def now_iso() -> str:
     return datetime.utcnow().isoformat()
+
+
+
+def to_json(value) -> str:
+    # nested blobs are sent as JSON text; the backend stores them as-is
+    return json.dumps(value if value is not None else {}, default=str, separators=(",", ":"))
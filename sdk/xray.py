@@ -1,49 +1,64 @@
+from .sampling import make_sampler
+from .spool import SpoolWriter, discard
 from .transport import XRayTransport
-from .utils import new_id, now_iso
+from .utils import new_id, now_iso, to_json
 from contextlib import contextmanager
 import time
 
+CAPTURE_MODES = ("summary", "sample", "full")
 
-class XRay:
-    def __init__(self, api_url: str, capture_mode="sample"):
-        self.transport = XRayTransport(api_url)
-        self.capture_mode = capture_mode  # summary | sample | full
 
-    # --------- RUN LEVEL ---------
-    def start_run(self, pipeline_name: str, input_summary=None, metadata=None):
+class XRayBase:
+    """Run/step bookkeeping shared by the sync and asyncio clients."""
+
+    def __init__(self, capture_mode="sample"):
+        self.capture_mode = _check_capture_mode(capture_mode)  # summary | sample | full
+        self.run_capture_modes = {}  # per-run overrides from start_run
+        self.run_pipelines = {}  # run_id -> pipeline_name, copied onto each step
+
+    def _start_run_payload(self, pipeline_name, input_summary, metadata, capture_mode):
         run_id = new_id()
+        self.run_pipelines[run_id] = pipeline_name
+        if capture_mode is not None:
+            self.run_capture_modes[run_id] = _check_capture_mode(capture_mode)
 
-        payload = {
+        return {
             "run_id": run_id,
             "pipeline_name": pipeline_name,
-            "input_summary": input_summary or {},
+            "input_summary": to_json(input_summary),
             "started_at": now_iso(),
-            "metadata": metadata or {},
+            "metadata": to_json(metadata),
         }
 
-        self.transport.post_sync("/ingest/run", payload)
-        return run_id
-
-    def end_run(self, run_id: str, outcome_summary=None):
-        payload = {
+    def _end_run_payload(self, run_id, outcome_summary):
+        self.run_capture_modes.pop(run_id, None)
+        self.run_pipelines.pop(run_id, None)
+        return {
             "run_id": run_id,
             "pipeline_name": "",  # ignored on update
-            "input_summary": {},
-            "outcome_summary": outcome_summary or {},
+            "input_summary": "{}",
+            "outcome_summary": to_json(outcome_summary),
             "started_at": "",
             "ended_at": now_iso(),
-            "metadata": {},
+            "metadata": "{}",
         }
-        self.transport.post_sync("/ingest/run", payload)
 
-    # --------- STEP LEVEL ---------
-    @contextmanager
-    def step(self, run_id, step_name, step_type, input_summary=None, max_samples=50):
-        step_id = new_id()
-        start = time.time()
+    def _open_step(
+        self,
+        run_id,
+        step_name,
+        step_type,
+        input_summary,
+        max_samples,
+        sample_strategy,
+        capture_mode,
+    ):
+        capture_mode = _check_capture_mode(
+            capture_mode or self.run_capture_modes.get(run_id, self.capture_mode)
+        )
 
         step_state = {
-            "step_id": step_id,
+            "step_id": new_id(),
             "run_id": run_id,
             "step_name": step_name,
             "step_type": step_type,  # query-able across pipelines
@@ -51,24 +66,116 @@ class XRay:
             "output_summary": {},
             "metrics": {},
             "reasoning": None,
-            "context": {"capture_mode": self.capture_mode},
+            "context": {"capture_mode": capture_mode},
             "samples": [],
-            "pipeline_name": "",  # optional if backend derives it
+            # the backend falls back to the run's for runs started elsewhere
+            "pipeline_name": self.run_pipelines.get(run_id, ""),
         }
 
+        return StepLogger(
+            step_state,
+            max_samples=max_samples,
+            sample_strategy=sample_strategy,
+            capture_mode=capture_mode,
+        )
+
+    def _close_step(self, logger, start):
+        """Returns the step payload and a spool file to upload (or None)."""
+        state = logger.state
+        state["metrics"]["latency_ms"] = round((time.time() - start) * 1000, 2)
+        spool_path = logger.finalize()
+        payload = {**state, "created_at": now_iso()}
+        for key in ("input_summary", "output_summary", "metrics", "context"):
+            payload[key] = to_json(state[key])
+        return payload, spool_path
+
+
+class XRay(XRayBase):
+    def __init__(self, api_url: str, capture_mode="sample", exporter="sync", **exporter_options):
+        super().__init__(capture_mode)
+        # exporter="batch" queues payloads and ships them from a background worker
+        self.transport = XRayTransport(api_url, mode=exporter, **exporter_options)
+
+    # --------- RUN LEVEL ---------
+    def start_run(
+        self, pipeline_name: str, input_summary=None, metadata=None, capture_mode=None
+    ):
+        payload = self._start_run_payload(
+            pipeline_name, input_summary, metadata, capture_mode
+        )
+        self.transport.post_sync("/ingest/run", payload)
+        return payload["run_id"]
+
+    def end_run(self, run_id: str, outcome_summary=None):
+        payload = self._end_run_payload(run_id, outcome_summary)
+        self.transport.post_sync("/ingest/run", payload)
+
+    def flush(self, timeout=None):
+        return self.transport.flush(timeout)
+
+    def shutdown(self):
+        self.transport.shutdown()
+
+    # --------- STEP LEVEL ---------
+    @contextmanager
+    def step(
+        self,
+        run_id,
+        step_name,
+        step_type,
+        input_summary=None,
+        max_samples=50,
+        sample_strategy="head",  # head | reservoir | stratified | top_k
+        capture_mode=None,  # defaults to the run's, then the client's mode
+    ):
+        start = time.time()
+        logger = self._open_step(
+            run_id,
+            step_name,
+            step_type,
+            input_summary,
+            max_samples,
+            sample_strategy,
+            capture_mode,
+        )
+
         try:
-            yield StepLogger(step_state, max_samples=max_samples)
+            yield logger
         finally:
-            step_state["metrics"]["latency_ms"] = round((time.time() - start) * 1000, 2)
-
-            payload = {**step_state, "created_at": now_iso()}
+            payload, spool_path = self._close_step(logger, start)
             self.transport.post_sync("/ingest/step", payload)
 
+            if spool_path:
+                self.transport.post_file(
+                    f"/ingest/samples/{payload['step_id']}", spool_path
+                )
+
+
+def _check_capture_mode(mode):
+    if mode not in CAPTURE_MODES:
+        raise ValueError(f"unknown capture mode: {mode!r}")
+    return mode
+
+
+CANDIDATE_COLUMNS = ("candidate_id", "score", "decision", "rejection_reason", "attributes")
+
 
 class StepLogger:
-    def __init__(self, state, max_samples=50):
+    def __init__(self, state, max_samples=50, sample_strategy="head", capture_mode="sample"):
         self.state = state
         self.max_samples = max_samples
+        self.capture_mode = capture_mode
+        self.sample_strategy = sample_strategy
+        self.sampler = None
+        self.spool = None
+        self.skipped = 0
+        self.provided_columns = set()  # columns some log_candidates call passed
+
+        if capture_mode == "full":
+            # every candidate, streamed to disk rather than kept in memory
+            self.spool = SpoolWriter()
+        elif capture_mode == "sample":
+            self.sampler = make_sampler(sample_strategy, max_samples)
 
     def log_output(self, data):
         self.state["output_summary"] = data
@@ -90,15 +197,118 @@ class StepLogger:
         decision=None,
         rejection_reason=None,
     ):
-        if len(self.state["samples"]) >= self.max_samples:
+        if self.capture_mode == "summary":
+            self.skipped += 1
             return
 
-        self.state["samples"].append(
-            {
-                "candidate_id": candidate_id,
-                "attributes": attributes or {},
-                "score": score,
-                "decision": decision,
-                "rejection_reason": rejection_reason,
+        sample = {
+            "candidate_id": candidate_id,
+            "attributes": attributes or {},
+            "score": score,
+            "decision": decision,
+            "rejection_reason": rejection_reason,
+        }
+
+        if self.spool is not None:
+            self.spool.write(sample)
+        else:
+            self.sampler.offer(sample)
+
+    def log_candidates(
+        self, ids, scores=None, decisions=None, reasons=None, attributes=None
+    ):
+        """
+        Log many candidates at once from parallel sequences (lists, tuples or
+        NumPy arrays). Rows are offered to the step's sampler in bulk, so
+        there is no per-candidate call or dict; they share the `max_samples`
+        budget and the sample_strategy with log_sample, and the kept rows
+        are shipped as columns.
+        """
+        ids = _column(ids)
+        n = len(ids)
+        columns = {
+            "candidate_id": ids,
+            "score": _column(scores, n),
+            "decision": _column(decisions, n),
+            "rejection_reason": _column(reasons, n),
+            "attributes": _column(attributes, n),
+        }
+
+        if self.capture_mode == "summary":
+            self.skipped += n
+            return
+
+        if self.spool is not None:
+            names = [k for k, v in columns.items() if v is not None]
+            for row in zip(*(columns[k] for k in names)):
+                self.spool.write(dict(zip(names, row)))
+            return
+
+        self.provided_columns.update(k for k, v in columns.items() if v is not None)
+        values = [columns[k] for k in CANDIDATE_COLUMNS]
+
+        def row(i):
+            # kept rows are tuples in CANDIDATE_COLUMNS order; log_sample's are dicts
+            return tuple(None if v is None else v[i] for v in values)
+
+        strata = None
+        if self.sample_strategy == "stratified":
+            none = [None] * n
+            strata = list(zip(columns["decision"] or none, columns["rejection_reason"] or none))
+        self.sampler.offer_rows(n, row, scores=columns["score"], strata=strata)
+
+    def finalize(self):
+        """Settle captured samples into the step state; returns a spool path to upload, if any."""
+        if self.spool is not None:
+            path = self.spool.close()
+            if not self.spool.count:
+                discard(path)
+                return None
+            self.state["context"]["sampling"] = {
+                "strategy": "full",
+                "seen": self.spool.count,
+                "kept": self.spool.count,
             }
-        )
+            return path
+
+        if self.sampler is None:
+            if self.skipped:
+                self.state["context"]["sampling"] = {
+                    "strategy": "none",
+                    "seen": self.skipped,
+                    "kept": 0,
+                }
+            return None
+
+        kept = self.sampler.samples()
+        rows = [s for s in kept if isinstance(s, tuple)]
+        self.state["samples"] = [
+            {**s, "attributes": to_json(s["attributes"])} for s in kept if isinstance(s, dict)
+        ]
+        if rows:
+            self.state["candidates"] = {
+                name: [r[j] for r in rows]
+                for j, name in enumerate(CANDIDATE_COLUMNS)
+                if name in self.provided_columns
+            }
+            attributes = self.state["candidates"].get("attributes")
+            if attributes is not None:
+                self.state["candidates"]["attributes"] = [
+                    None if a is None else to_json(a) for a in attributes
+                ]
+        if self.sampler.seen:
+            self.state["context"]["sampling"] = {
+                "strategy": self.sampler.strategy,
+                "seen": self.sampler.seen,
+                "kept": len(kept),
+            }
+        return None
+
+
+def _column(values, n=None):
+    if values is None:
+        return None
+    values = values.tolist() if hasattr(values, "tolist") else list(values)
+    if n is not None and len(values) != n:
+        raise ValueError(f"column has {len(values)} values, expected {n}")
+    return values